@@ -5,6 +5,7 @@
 
 from globals import *
 import pandas as pd
+import numpy as np
 import math
 import time
 
@@ -24,79 +25,92 @@ STATIONS = stations.get_stations(STATION_FILE_PATH, COUNTRIES_FILE_PATH)
 
 TEMPERATURES = temperatures.get_temperatures_by_station(TEMPERATURES_FILE_PATH, STATIONS)
 
-# "TEMPERATURES" data is grouped by station, so counting its length will tell us the total number of Stations
-TOTAL_STATIONS = len(TEMPERATURES)
+# Sort the temperature data by station so it can be processed in blocks of stations
+STATIONS_DATA = temperatures.arrange_by_station(TEMPERATURES)
 
-station_iteration = 0
+TOTAL_STATIONS = len(STATIONS_DATA['station_id'])
 
 # Our goal is to have an array of annual anomalies for every station that we can then average or grid and average
-annual_anomalies_by_station = []
+annual_anomalies_by_station = np.full((TOTAL_STATIONS, len(YEAR_RANGE_LIST)), math.nan)
 
-# For each station file
-for station_id, temperature_data_for_station in TEMPERATURES:
+station_metadata = []
 
-  # We wish to give the Developer a quick reference to the station's starting and ending years.
-  start_year, end_year = temperatures.get_station_start_and_end_year(temperature_data_for_station)
+# Rather than processing one station at a time, we calculate anomalies for a whole block of stations at once
+for first_station in range(0, TOTAL_STATIONS, temperatures.STATIONS_PER_BLOCK):
 
-  # Reindex the station data to fit our year range
-  temperatures_by_month = temperature_data_for_station.reindex(YEAR_RANGE_LIST, fill_value=math.nan)
+  last_station = min(first_station + temperatures.STATIONS_PER_BLOCK, TOTAL_STATIONS)
+
+  # The monthly temperatures of each station in this block, with a row for each year the station has data for
+  station_records = temperatures.get_station_records(STATIONS_DATA, first_station, last_station)
 
   # To convert absolute temperatures to anomalies, you need to have a baseline to compare temperature changes to so you can calculate the anomalies. We will create a separate baseline for each month of the year, averaging the reference years according to the Developer Settings in "constants.py"
-  baseline_by_month = anomaly.average_reference_years_by_month(temperatures_by_month)
+  baseline_by_month = anomaly.average_reference_years_by_month(station_records)
+
+  # Calculate anomalies for each year on a month class by month class basis (Jan to Jan, Feb to Feb, ...) relative to the baselines we calculated earlier (for each month)
+  anomalies_by_month = anomaly.calculate_anomalies_by_month(station_records, baseline_by_month)
+
+  # For each year, average the anomalies for all 12 months. It is ok if some months are missing data since we first converted them to anomalies before averaging. Only now are the annual anomalies placed into our year range
+  annual_anomalies_by_station[ first_station + station_records['station_index'], station_records['year'] - YEAR_RANGE_START ] = anomaly.average_anomalies_by_year(anomalies_by_month)
+
+  # Calculate the absolute temperature trend of every month class for each station in the block, as well as the average trend of each station
+  absolute_trends_by_month, absolute_trends = anomaly.average_trends(station_records)
 
-  # Calculate anomalies for each year on a month class by month class basis (Jan to Jan, Feb to Feb, ...) relative to the baselines we calculated earlier (for each month) and return an array of month class arrays
-  anomalies_by_month = anomaly.calculate_anomalies_by_month(temperatures_by_month, baseline_by_month)
+  for station_in_block, absolute_trend in enumerate(absolute_trends):
 
-  # For each year, average the anomalies for all 12 months and return an list of average anomalies by year. It is ok if some months are missing data since we first converted them to anomalies before averaging.
-  average_anomalies_by_year = anomaly.average_anomalies(anomalies_by_month)
+    station_iteration = first_station + station_in_block
 
-  station_location, station_quadrant = stations.get_station_metadata(station_id, STATIONS)
+    station_id = STATIONS_DATA['station_id'][station_iteration]
 
-  # Add important metadata to the beginning of each station's column (station's ID, station's location, and station's grid box label). The grid box label is important if we wish to average by grid instead of by station.
-  annual_anomalies_and_metadata = [station_id, station_location, station_quadrant] + list(average_anomalies_by_year)
+    # We wish to give the Developer a quick reference to the station's starting and ending years.
+    start_year, end_year = STATIONS_DATA['start_year'][station_iteration], STATIONS_DATA['end_year'][station_iteration]
 
-  annual_anomalies_by_station.append(annual_anomalies_and_metadata)
+    station_location, station_quadrant = stations.get_station_metadata(station_id, STATIONS)
 
-  absolute_trend = anomaly.average_trends(temperatures_by_month)
+    # Keep important metadata for each station's column (station's ID, station's location, and station's grid box label). The grid box label is important if we wish to average by grid instead of by station.
+    station_metadata.append([station_id, station_location, station_quadrant])
 
-  absolute_visual = output.update_statistics(absolute_trend)
-    
-  station_iteration += 1
+    absolute_visual = output.update_statistics(absolute_trend)
 
-  output.compose_station_console_output(station_iteration, TOTAL_STATIONS, station_id, absolute_visual, absolute_trend, start_year, end_year, station_location, station_quadrant)
+    output.compose_station_console_output(station_iteration + 1, TOTAL_STATIONS, station_id, absolute_visual, absolute_trend, start_year, end_year, station_location, station_quadrant)
 
 # Remember those statistics we collected earlier? We finally show them to the Developer in the Console.
 output.print_summary_to_console(TOTAL_STATIONS, TEMPERATURES_FILE_PATH)
 
-# If we convert our list of station annual anomalies into a dataframe, it makes it easier to work with.
-annual_anomalies_by_station_dataframe = pd.DataFrame(
-  annual_anomalies_by_station,
-  columns = ['station_id', "location", "quadrant" ] + YEAR_RANGE_LIST
-)
+# If we convert our array of station annual anomalies into a dataframe along with each station's metadata, it makes it easier to work with.
+annual_anomalies_by_station_dataframe = pd.concat([
+
+  pd.DataFrame(station_metadata, columns = ['station_id', "location", "quadrant" ]),
+
+  pd.DataFrame(annual_anomalies_by_station, columns = YEAR_RANGE_LIST)
+
+], axis=1)
 
 # Average annual anomolies across all ungridded stations
 ungridded_anomalies = anomaly.average_anomalies(annual_anomalies_by_station_dataframe, axis=0)
 
 # Data in GHCNm arrives measured in 100ths of a degree, so we convert it into natural readings
-ungridded_anomalies_divided = ungridded_anomalies.apply(anomaly.divide_by_one_hundred)
+ungridded_anomalies_divided = anomaly.divide_by_one_hundred(ungridded_anomalies)
 
 # Separate stations into their respective grid boxes and average all anomalies by year per grid box
-annual_anomalies_by_grid = anomaly.average_stations_per_grid(annual_anomalies_by_station_dataframe)
+station_grid_ids = stations.get_station_grid_ids(STATIONS_DATA['station_id'], STATIONS)
 
-annual_anomalies_by_grid_of_land = anomaly.average_stations_per_grid(
-  annual_anomalies_by_station_dataframe, use_land_ratio = True
-)
+annual_anomalies_by_grid, grid_ids = anomaly.average_stations_per_grid(annual_anomalies_by_station_dataframe, station_grid_ids)
+
+# Weigh each grid box by the cosine of the mid-latitude point for that grid box, by the land ratio, and by any of the Developer's own weight tables, and average all grid boxes with data. The result is a list of global anomalies by year for each weighting.
+gridded_anomalies_by_weighting = anomaly.average_all_grids(annual_anomalies_by_grid, stations.get_grid_weightings(grid_ids))
 
-# Weigh each grid box by the cosine of the mid-latitude point for that grid box (and possibly the land ratio) and average all grid boxes with data. The result is a list of global anomalies by year.
-gridded_anomalies = anomaly.average_all_grids(annual_anomalies_by_grid)
+# Along with the average anomalies, keep how many grid boxes with how much weight went into each year's average
+grid_coverage = gridded_anomalies_by_weighting.pop('cosine')
+
+gridded_anomalies = grid_coverage['anomaly']
 
 # Data in GHCNm arrives measured in 100ths of a degree, so we convert it into natural readings
-gridded_anomalies_divided = gridded_anomalies.apply(anomaly.divide_by_one_hundred)
+gridded_anomalies_divided = anomaly.divide_by_one_hundred(gridded_anomalies)
 
 # Also weigh each grid by land ratio
-gridded_anomalies_of_land = anomaly.average_all_grids(annual_anomalies_by_grid_of_land)
+gridded_anomalies_of_land = gridded_anomalies_by_weighting.pop('land ratio')['anomaly']
 
-gridded_anomalies_of_land_divided = gridded_anomalies_of_land.apply(anomaly.divide_by_one_hundred)
+gridded_anomalies_of_land_divided = anomaly.divide_by_one_hundred(gridded_anomalies_of_land)
 
 # Finally prepare the data for Excel and save
 output.create_excel_file(
@@ -110,6 +124,14 @@ output.create_excel_file(
   average_of_grids_by_land_ratio = gridded_anomalies_of_land,
   average_of_grids_by_land_ratio_divided = gridded_anomalies_of_land_divided,
 
+  average_of_grids_by_weighting = {
+
+    weighting: averages['anomaly'] for weighting, averages in gridded_anomalies_by_weighting.items()
+
+  },
+
+  grid_coverage = grid_coverage,
+
   anomalies_by_grid = annual_anomalies_by_grid,
   anomalies_by_station = annual_anomalies_by_station_dataframe,
 
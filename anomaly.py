@@ -21,43 +21,77 @@ def mean_and_round(df, rounding_decimals = 2, axis=1):
 
   else:  
 
-    return df.mean(skipna=True, numeric_only=True, axis=axis).apply(normal_round, args=(rounding_decimals,))
+    return normal_round_array(df.mean(skipna=True, numeric_only=True, axis=axis), rounding_decimals)
 
 
-def divide_by_one_hundred(num):
+def divide_by_one_hundred(anomalies):
 
-  return normal_round(num / 100, 3)
+  return normal_round_array(anomalies / 100, 3)
 
 
-def mean_if_enough_data(row, minimum_years_needed):
+# Average an array along `axis` ignoring NaN, but only where there are at least `minimum_needed` values to average. Otherwise the average is NaN
+def mean_if_enough_data(values, minimum_needed, axis):
 
-  return mean_and_round(row) if row.count() >= minimum_years_needed else math.nan
+  is_available = ~np.isnan(values)
 
+  count = is_available.sum(axis=axis)
 
-def average_reference_years_by_month(temperatures_by_month):
+  total = np.where(is_available, values, 0).sum(axis=axis)
 
-  reference_years = temperatures_by_month.loc[ RANGE_OF_REFERENCE_YEARS, MONTH_COLUMNS ]
+  has_enough_data = (count >= minimum_needed) & (count > 0)
 
-  minimum_years_needed = get_minimum_years(REFERENCE_RANGE)
+  return np.where(has_enough_data, total / np.where(has_enough_data, count, 1), math.nan)
 
-  baseline_by_month = reference_years.apply(mean_if_enough_data, args=(minimum_years_needed,))
 
-  return baseline_by_month
+# Add up the rows of `values` that belong to each station, for every column at once. Returns a (stations x columns) array
+def sum_by_station(station_indexes, values, total_stations):
 
+  return np.stack([
 
-def calculate_anomaly(temperature, baseline_by_month):
+    np.bincount(station_indexes, weights=values[:, column], minlength=total_stations) for column in range(values.shape[1])
 
-  month = int(temperature.name) - 1
+  ], axis=1)
 
-  reference_average_for_month = baseline_by_month[month]
 
-  return temperature.subtract(reference_average_for_month, fill_value=math.nan).apply(normal_round, args=(2,))
+'''
+  Calculate a baseline for each month of every station from its reference years. Like the other calculations on `station_records` (see temperatures.get_station_records), only the years each station actually has data for are used: one row per station and year, with the station each row belongs to.
+
+  Returns a (stations x 12) array of baselines.
+'''
+def average_reference_years_by_month(station_records):
+
+  years, temperatures = station_records['year'], station_records['temperatures']
+
+  is_reference_year = (years >= REFERENCE_START_YEAR) & (years <= REFERENCE_END_YEAR)
+
+  reference_temperatures = temperatures[is_reference_year]
+
+  is_available = ~np.isnan(reference_temperatures)
+
+  station_indexes, total_stations = station_records['station_index'][is_reference_year], station_records['total_stations']
+
+  # Readings are whole hundredths of a degree, so their sums are exact in any order
+  total = sum_by_station(station_indexes, np.where(is_available, reference_temperatures, 0), total_stations)
+
+  count = sum_by_station(station_indexes, is_available, total_stations)
+
+  has_enough_data = (count >= get_minimum_years(REFERENCE_RANGE)) & (count > 0)
+
+  baseline_by_month = np.where(has_enough_data, total / np.where(has_enough_data, count, 1), math.nan)
+
+  return normal_round_array(baseline_by_month, 2)
 
 
-# Within each month class, calculate annual anomalies using array of fixed reference averages provided
-def calculate_anomalies_by_month(temperatures_by_month, baseline_by_month):
+# Within each month class, calculate annual anomalies using the array of fixed reference averages for each station. Returns an anomaly for every month of each row of `station_records`
+def calculate_anomalies_by_month(station_records, baseline_by_month):
 
-  return temperatures_by_month[ MONTH_COLUMNS ].apply(calculate_anomaly, args=(baseline_by_month,))
+  return normal_round_array(station_records['temperatures'] - baseline_by_month[ station_records['station_index'] ], 2)
+
+
+# For each station and year, average the anomalies of all available months
+def average_anomalies_by_year(anomalies_by_month):
+
+  return normal_round_array(mean_if_enough_data(anomalies_by_month, 1, axis=1), 2)
 
 
 def average_anomalies(lists_of_anomalies, axis=1):
@@ -65,78 +99,146 @@ def average_anomalies(lists_of_anomalies, axis=1):
   return mean_and_round(lists_of_anomalies, axis=axis)
 
 
-def weighted_avg(df, weights):
+'''
+  Average all grid boxes together for every year with each of the `grid_weightings` (see stations.get_grid_weightings), which are lists of weights in the same order as the rows of `anomalies_by_grid`. Since the anomalies of the grid boxes are the same for every weighting, all weightings are applied at once as a single product of the (weightings x grids) weights and the (grids x years) anomalies, side by side with the (grids x years) mask of available anomalies:
+
+    average = Σ(weight * anomaly) / Σ(weight)
+
+  Grid boxes without an anomaly for the year, or without a weight in a weighting, are left out of that year's average.
   
-  # Only average grids and weights that are not NaN
-  indices = ~np.isnan(df)
+  Returns a table for each weighting with the average anomaly of each year, along with the total weight and number of grid boxes that went into it. These show how much of the earth each year's average covers.
+'''
+def average_all_grids(anomalies_by_grid, grid_weightings):
 
-  if np.isnan(df).all():
+  anomalies = anomalies_by_grid[ YEAR_RANGE_LIST ].to_numpy(dtype=np.float64)
 
-    return math.nan
+  weights = np.array(list(grid_weightings.values()), dtype=np.float64)
 
-  else:
-    
-    return (df[indices] * weights[indices]).sum() / weights[indices].sum()
+  is_available = ~np.isnan(anomalies)
 
+  # A weight of zero leaves the grid box out of both sums
+  weights = np.where(np.isnan(weights), 0, weights)
 
-def average_all_grids(anomalies_by_grid):
+  weighted_sum, total_weight = np.split(
 
-  return anomalies_by_grid[ YEAR_RANGE ].apply(
+    weights @ np.concatenate([ np.where(is_available, anomalies, 0), is_available ], axis=1), 2, axis=1
 
-    weighted_avg, args=(anomalies_by_grid['weight'],),
+  )
 
-  ).apply(normal_round, args=(2,))
+  total_grid_boxes = (weights != 0).astype(np.int64) @ is_available.astype(np.int64)
 
+  average_by_year = np.where(total_weight > 0, weighted_sum / np.where(total_weight > 0, total_weight, 1), math.nan)
 
-def average_by_grid(stations_in_grid, use_land_ratio = False):
+  return {
 
-  quadrant = stations_in_grid.name
+    name: pd.DataFrame({
 
-  weight = stations.determine_grid_weight(quadrant, use_land_ratio=use_land_ratio)
+      'anomaly': normal_round_array(average_by_year[weighting], 2),
 
-  average_by_year = mean_and_round(stations_in_grid, axis=0)
+      'total_weight': normal_round_array(total_weight[weighting], 4),
 
-  index = [ "weight" ] + list(YEAR_RANGE)
+      'grid_boxes': total_grid_boxes[weighting],
 
-  values = [ weight ] + list(average_by_year)
+    }, index=YEAR_RANGE_LIST) for weighting, name in enumerate(grid_weightings)
 
-  return pd.Series(values, index=index)
+  }
 
 
-def average_stations_per_grid(lists_of_anomalies_by_station, use_land_ratio = False):
+'''
+  Average the annual anomalies of all stations within each grid box. Rather than grouping by the quadrant label, stations are sorted by their integer grid box ID so the stations of each grid box sit next to each other and each grid box is averaged for all years with a single array operation. Stations outside of any grid box (ID of -1) are left out.
+  
+  Returns a table with a row for each grid box that has stations, labeled by its quadrant, with the cosine weight of the grid box followed by its average anomaly for each year, along with the grid box ID of each row.
+'''
+def average_stations_per_grid(lists_of_anomalies_by_station, grid_ids):
 
-  return lists_of_anomalies_by_station.groupby('quadrant').apply(average_by_grid, use_land_ratio)
+  is_in_grid = grid_ids >= 0
 
+  grid_ids = grid_ids[is_in_grid]
 
-def calculate_trend(average_anomalies_by_year):
+  occupied_grid_ids, grid_indexes = np.unique(grid_ids, return_inverse=True)
 
-  y = average_anomalies_by_year.to_numpy()
+  station_order = np.argsort(grid_indexes, kind='stable')
 
-  years = average_anomalies_by_year.index.to_numpy()
+  first_station_of_grid = np.searchsorted(grid_indexes[station_order], np.arange(len(occupied_grid_ids)))
 
-  # Limit our range to only numbers and only years between the ABSOLUTE_START_YEAR and ABSOLUTE_END_YEAR
-  idx = (np.isfinite(years) & np.isfinite(y) & 
-    np.greater_equal(years, ABSOLUTE_START_YEAR) & np.less(years, ABSOLUTE_END_YEAR))
+  # A (stations x years) array with the stations of each grid box next to each other
+  anomalies = lists_of_anomalies_by_station.loc[is_in_grid, YEAR_RANGE_LIST].to_numpy(dtype=np.float64)[station_order]
 
+  is_available = ~np.isnan(anomalies)
 
-  minimum_for_reliable_average = get_minimum_years(ABSOLUTE_END_YEAR - ABSOLUTE_START_YEAR)
+  # Add up the anomalies and the number of available anomalies of the stations of every grid box at once, for every year
+  total = np.add.reduceat(np.where(is_available, anomalies, 0), first_station_of_grid, axis=0)
+
+  count = np.add.reduceat(is_available.astype(np.int64), first_station_of_grid, axis=0)
+
+  average_by_grid = normal_round_array(np.where(count > 0, total / np.where(count > 0, count, 1), math.nan), 2)
 
-  if len(years[idx]) >= minimum_for_reliable_average:
+  quadrants = lists_of_anomalies_by_station.loc[is_in_grid, 'quadrant'].to_numpy()[station_order][first_station_of_grid]
+
+  # Keep the grid boxes in order of their labels
+  grid_order = np.argsort(quadrants, kind='stable')
+
+  anomalies_by_grid = pd.DataFrame(average_by_grid[grid_order], index=pd.Index(quadrants[grid_order], name='quadrant'), columns=YEAR_RANGE_LIST)
+
+  anomalies_by_grid.insert(0, 'weight', stations.determine_grid_weight(occupied_grid_ids[grid_order]))
+
+  return anomalies_by_grid, occupied_grid_ids[grid_order]
+
+
+'''
+  Calculate the least squares slope of each month class of every station at once. Instead of fitting each month separately, the slope is formed directly from the sums of x, y, xy, x² and the number of available years:
+
+    slope = (n * Σxy - Σx * Σy) / (n * Σx² - (Σx)²)
+
+  Returns a (stations x 12) array of slopes, NaN where a month class does not have enough years between the ABSOLUTE_START_YEAR and ABSOLUTE_END_YEAR.
+'''
+def calculate_trends(station_records):
+
+  years = station_records['year']
+
+  # Limit our range to only years between the ABSOLUTE_START_YEAR and ABSOLUTE_END_YEAR
+  is_in_range = (years >= ABSOLUTE_START_YEAR) & (years < ABSOLUTE_END_YEAR)
+
+  y = station_records['temperatures'][is_in_range]
+
+  # Measuring years from the middle of the range keeps the sums small, which avoids losing precision when they are subtracted
+  x = (years[is_in_range] - (ABSOLUTE_START_YEAR + ABSOLUTE_END_YEAR) / 2)[:, np.newaxis]
+
+  # Only use years with a reading
+  is_available = ~np.isnan(y)
+
+  y = np.where(is_available, y, 0)
+
+  x = np.where(is_available, x, 0)
+
+  station_indexes, total_stations = station_records['station_index'][is_in_range], station_records['total_stations']
+
+  n = sum_by_station(station_indexes, is_available, total_stations)
+
+  sum_x = sum_by_station(station_indexes, x, total_stations)
+
+  sum_y = sum_by_station(station_indexes, y, total_stations)
+
+  sum_xy = sum_by_station(station_indexes, x * y, total_stations)
+
+  sum_xx = sum_by_station(station_indexes, x * x, total_stations)
+
+  minimum_for_reliable_average = get_minimum_years(ABSOLUTE_END_YEAR - ABSOLUTE_START_YEAR)
 
-    slope_of_annual_temperatures = normal_round(np.polyfit(years[idx], y[idx], 1)[0], 3)
+  has_enough_years = (n >= minimum_for_reliable_average) & (n >= 2)
 
-    return slope_of_annual_temperatures
+  denominator = np.where(has_enough_years, n * sum_xx - sum_x ** 2, 1)
 
-  else:
+  slopes_of_annual_temperatures = np.where(has_enough_years, (n * sum_xy - sum_x * sum_y) / denominator, math.nan)
 
-    return math.nan
+  return normal_round_array(slopes_of_annual_temperatures, 3)
 
 
-# For each month class, calculate the annual absolute trend and finally average all trends
-def average_trends(temperatures_by_month):
+# For each month class of every station, calculate the annual absolute trend and finally average all trends of each station. Returns the trends of each month class along with the average trend for each station
+def average_trends(station_records):
 
-  absolute_trends = temperatures_by_month[ MONTH_COLUMNS ].apply(calculate_trend)
+  absolute_trends = calculate_trends(station_records)
 
-  average_absolute_trend = mean_and_round(absolute_trends, 3)
+  average_absolute_trend = normal_round_array(mean_if_enough_data(absolute_trends, 1, axis=1), 3)
 
-  return average_absolute_trend
+  return absolute_trends, average_absolute_trend
@@ -0,0 +1,304 @@
+'''
+  Extracts the downloaded .tar.gz archives, or lets the files inside them be used without extracting them to disk (see EXTRACT_ARCHIVES in constants.py). A file inside an archive is referred to by joining the path of the archive with the name of the file within it by a forward slash, on every operating system, for example:
+
+    ghcnm.v3.tavg.latest.qcu.tar.gz/ghcnm.v3.3.0.20220101/ghcnm.tavg.v3.3.0.20220101.qcu.dat
+'''
+
+import fnmatch
+import glob as file_glob
+import io
+import json
+import os
+import tarfile
+from termcolor import colored, cprint
+
+import cache
+
+ARCHIVE_EXTENSION = '.tar.gz'
+
+# Each archive gets a manifest next to it listing the name, size, modification time and header checksum of every file within it, along with the fingerprint of the archive (see cache.get_fingerprint). With it, later runs know what an archive holds without decompressing it
+MANIFEST_EXTENSION = '.manifest.json'
+
+# Archives with more files than this, like the GHCNd archive, only show how many files were extracted
+MAX_FILES_LISTED = 20
+
+check_mark = colored(u'\u2713', 'green', attrs=['bold'])
+
+# Archives whose files can be found with glob()
+archives_in_use = []
+
+# The names of the files within each archive, so each archive only needs to be listed once
+member_names_by_archive = {}
+
+# Files made by joining several files of an archive one after the other, like the USHCN station files, by the path they are referred to by within the archive. They are only read when they are needed, so they are never written to disk
+combined_files = {}
+
+
+def use_archives(downloaded_files):
+
+  for file_name in downloaded_files:
+
+    if file_name.endswith(ARCHIVE_EXTENSION) and file_name not in archives_in_use:
+
+      archives_in_use.append(file_name)
+
+
+# Split a path into the archive it is in and its name within the archive. Paths of files that aren't in an archive return no archive
+def split_archive_path(path):
+
+  archive, separator, member_name = path.partition(ARCHIVE_EXTENSION + '/')
+
+  if not separator:
+
+    return None, path
+
+  return archive + ARCHIVE_EXTENSION, member_name
+
+
+def is_in_archive(path):
+
+  return split_archive_path(path)[0] is not None
+
+
+# The path of a file within its archive, or the path itself for files that aren't in an archive
+def get_member_name(path):
+
+  return split_archive_path(path)[1]
+
+
+# Returns the manifest of an archive as it was last written, even if the archive changed since, or False if it has none
+def load_manifest(archive):
+
+  manifest_path = archive + MANIFEST_EXTENSION
+
+  if not os.path.exists(manifest_path):
+
+    return False
+
+  with open(manifest_path, 'r') as manifest_file:
+
+    return json.load(manifest_file)
+
+
+# Returns the manifest of an archive, or False if it has none or the archive changed since it was written
+def read_manifest(archive):
+
+  manifest = load_manifest(archive)
+
+  if not manifest:
+
+    return False
+
+  fingerprint = cache.get_fingerprint(archive)
+
+  if any(manifest.get(key) != fingerprint[key] for key in fingerprint):
+
+    return False
+
+  return manifest
+
+
+# What the manifest records about a file within an archive. A file that changed between releases of an archive can keep the same size, like the fixed-width GHCNd station files, so its modification time and header checksum are recorded as well
+def get_member_record(member):
+
+  return { 'name': member.name, 'size': member.size, 'mtime': member.mtime, 'chksum': member.chksum }
+
+
+def write_manifest(archive, members):
+
+  manifest = {
+
+    'archive': os.path.basename(archive),
+
+    **cache.get_fingerprint(archive),
+
+    'members': [ get_member_record(member) for member in members if member.isfile() ],
+
+  }
+
+  with open(archive + MANIFEST_EXTENSION, 'w') as manifest_file:
+
+    json.dump(manifest, manifest_file, indent=2)
+
+  return manifest
+
+
+# List the files within an archive from its manifest, or by reading through the archive once if it has no manifest yet
+def get_member_names(archive):
+
+  if archive not in member_names_by_archive:
+
+    manifest = read_manifest(archive)
+
+    if not manifest:
+
+      with tarfile.open(archive, mode="r|gz") as opened_archive:
+
+        manifest = write_manifest(archive, list(opened_archive))
+
+    member_names_by_archive[archive] = [ member['name'] for member in manifest['members'] ]
+
+  return member_names_by_archive[archive]
+
+
+# Whether a file of an archive is on disk as it was extracted. Extracting a file gives it the modification time it has within the archive
+def is_extracted(member):
+
+  if not os.path.isfile(member['name']):
+
+    return False
+
+  file_stats = os.stat(member['name'])
+
+  return file_stats.st_size == member['size'] and int(file_stats.st_mtime) == member.get('mtime')
+
+
+# Whether any file of the archive is missing from disk. This is answered from the manifest without decompressing the archive. Archives without a manifest are assumed to need extracting
+def needs_extraction(archive):
+
+  manifest = read_manifest(archive)
+
+  return not manifest or not all(is_extracted(member) for member in manifest['members'])
+
+
+'''
+  Extract the files of an archive that are missing from disk or changed since the archive was last extracted, in a single pass through the archive, and write the manifest of the archive along the way. Files that are already extracted, with the same size, modification time and header checksum recorded in the previous manifest, are skipped.
+'''
+def extract_archive(archive):
+
+  previous_manifest = load_manifest(archive)
+
+  previous_members = { member['name']: member for member in previous_manifest['members'] } if previous_manifest else {}
+
+  members = []
+
+  extracted_names = []
+
+  with tarfile.open(archive, mode="r|gz") as opened_archive:
+
+    for member in opened_archive:
+
+      members.append(member)
+
+      member_record = get_member_record(member)
+
+      if member.isfile() and not (is_extracted(member_record) and previous_members.get(member.name) == member_record):
+
+        if not extracted_names:
+
+          print(f"Extracting '{archive}' to:")
+
+        opened_archive.extract(member)
+
+        extracted_names.append(member.name)
+
+  write_manifest(archive, members)
+
+  if len(extracted_names) > MAX_FILES_LISTED:
+
+    print(f'  {check_mark} {len(extracted_names)} files')
+
+  elif extracted_names:
+
+    print(f'  {check_mark} ' + f'\n  {check_mark} '.join(extracted_names))
+
+
+# Like glob.glob(), but if no extracted files match, files are also searched for within the archives in use
+def glob(pattern):
+
+  matching_files = file_glob.glob(pattern)
+
+  if matching_files:
+
+    return matching_files
+
+  for archive in archives_in_use:
+
+    for member_name in get_member_names(archive):
+
+      if fnmatch.fnmatch(member_name, pattern):
+
+        matching_files.append(f"{archive}/{member_name}")
+
+  return matching_files
+
+
+# Refer to the files of an archive at `member_paths`, joined one after the other, by a single `path` within the same archive (see read_file)
+def add_combined_file(path, member_paths):
+
+  combined_files[path] = member_paths
+
+
+def read_file(path):
+
+  if path in combined_files:
+
+    contents_by_path = read_files(combined_files[path])
+
+    return b''.join(contents_by_path[member_path] for member_path in combined_files[path])
+
+  archive, member_name = split_archive_path(path)
+
+  if archive is None:
+
+    with open(path, 'rb') as opened_file:
+
+      return opened_file.read()
+
+  with tarfile.open(archive, mode="r:gz") as opened_archive:
+
+    return opened_archive.extractfile(member_name).read()
+
+
+# Read several files at once. Files within the same archive are read in a single pass through the archive rather than decompressing it again for each file. Returns the contents of each file by its path
+def read_files(paths):
+
+  contents_by_path = {}
+
+  paths_by_archive = {}
+
+  for path in paths:
+
+    archive, member_name = split_archive_path(path)
+
+    if archive is None:
+
+      contents_by_path[path] = read_file(path)
+
+    else:
+
+      paths_by_archive.setdefault(archive, {})[member_name] = path
+
+  for archive, paths_by_member_name in paths_by_archive.items():
+
+    with tarfile.open(archive, mode="r|gz") as opened_archive:
+
+      for member in opened_archive:
+
+        if member.name in paths_by_member_name:
+
+          contents_by_path[ paths_by_member_name[member.name] ] = opened_archive.extractfile(member).read()
+
+  return contents_by_path
+
+
+# Read through an archive once, returning the path and contents of each file within it whose name matches the pattern one file at a time, so only one of them is held in memory at a time
+def iterate_files(archive, pattern):
+
+  with tarfile.open(archive, mode="r|gz") as opened_archive:
+
+    for member in opened_archive:
+
+      if member.isfile() and fnmatch.fnmatch(member.name, pattern):
+
+        yield f"{archive}/{member.name}", opened_archive.extractfile(member).read()
+
+
+# Open a file for reading in binary, whether or not it is in an archive
+def open_file(path):
+
+  if not is_in_archive(path):
+
+    return open(path, 'rb')
+
+  return io.BytesIO(read_file(path))
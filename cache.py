@@ -0,0 +1,211 @@
+'''
+  Saves parsed temperature files as NumPy arrays (.npy), and the grid weights calculated from the land mask for each grid size (.npz), so later runs can skip parsing the original files entirely. Each cache is keyed by the size, modification time and content hash of the file it was parsed from, so a newly downloaded release of the data is parsed again automatically.
+'''
+
+from globals import *
+import numpy as np
+import hashlib
+import json
+import glob
+import os
+import shutil
+import archives
+from termcolor import colored, cprint
+
+check_mark = colored(u'\u2713', 'green', attrs=['bold'])
+
+# Folder the parsed arrays are saved to, relative to where the program is run from
+PARSED_CACHE_FOLDER = 'parsed_cache'
+
+# Remembers the content hash of each file by its size and modification time so unchanged files don't need to be hashed again
+FINGERPRINTS_FILE = os.path.join(PARSED_CACHE_FOLDER, 'fingerprints.json')
+
+# Describes the arrays within each cache folder. It is written last, so a cache without one is incomplete and ignored
+MANIFEST_FILE = 'manifest.json'
+
+# Increase when the layout of the saved arrays changes so older caches are parsed again
+CACHE_FORMAT_VERSION = 3
+
+# Read files in pieces of this many bytes when hashing
+HASH_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def read_fingerprints():
+
+  if not os.path.exists(FINGERPRINTS_FILE):
+
+    return {}
+
+  with open(FINGERPRINTS_FILE, 'r') as fingerprints_file:
+
+    return json.load(fingerprints_file)
+
+
+def hash_file(url):
+
+  file_hash = hashlib.sha256()
+
+  with open(url, 'rb') as file_to_hash:
+
+    for chunk in iter(lambda: file_to_hash.read(HASH_CHUNK_SIZE), b''):
+
+      file_hash.update(chunk)
+
+  return file_hash.hexdigest()
+
+
+# Returns the size, modification time and content hash of a file. The hash is only recalculated if the size or modification time changed since the last run. Files within an archive (see archives.py) use the fingerprint of their archive
+def get_fingerprint(url):
+
+  archive = archives.split_archive_path(url)[0]
+
+  file_stats = os.stat(archive or url)
+
+  fingerprint = { 'size': file_stats.st_size, 'mtime': file_stats.st_mtime_ns }
+
+  fingerprints = read_fingerprints()
+
+  known_fingerprint = fingerprints.get(os.path.abspath(url), {})
+
+  if known_fingerprint.get('size') == fingerprint['size'] and known_fingerprint.get('mtime') == fingerprint['mtime']:
+
+    fingerprint['hash'] = known_fingerprint['hash']
+
+  else:
+
+    fingerprint['hash'] = hash_file(archive or url)
+
+    fingerprints[os.path.abspath(url)] = fingerprint
+
+    os.makedirs(PARSED_CACHE_FOLDER, exist_ok=True)
+
+    with open(FINGERPRINTS_FILE, 'w') as fingerprints_file:
+
+      json.dump(fingerprints, fingerprints_file, indent=2)
+
+  return fingerprint
+
+
+def get_cache_folder(url, fingerprint):
+
+  return os.path.join(PARSED_CACHE_FOLDER, f"{os.path.basename(url)}.{fingerprint['hash'][:16]}")
+
+
+def read_manifest(cache_folder):
+
+  manifest_path = os.path.join(cache_folder, MANIFEST_FILE)
+
+  if not os.path.exists(manifest_path):
+
+    return False
+
+  with open(manifest_path, 'r') as manifest_file:
+
+    return json.load(manifest_file)
+
+
+# Load the parsed arrays of a file if they have been cached, otherwise return False. Arrays are memory-mapped so only the parts that are used get read from disk
+def load_parsed_file(url):
+
+  fingerprint = get_fingerprint(url)
+
+  cache_folder = get_cache_folder(url, fingerprint)
+
+  manifest = read_manifest(cache_folder)
+
+  if not manifest or manifest['version'] != CACHE_FORMAT_VERSION or manifest['network'] != NETWORK or manifest['hash'] != fingerprint['hash']:
+
+    return False
+
+  print(f"{check_mark} Loaded parsed '{os.path.basename(url)}' from '{cache_folder}'")
+
+  return {
+
+    name: np.load(os.path.join(cache_folder, f"{name}.npy"), mmap_mode='r') for name in manifest['arrays']
+
+  }
+
+
+# Save each parsed array to its own .npy file and remove caches from older versions of the same file
+def save_parsed_file(url, parsed_file):
+
+  fingerprint = get_fingerprint(url)
+
+  cache_folder = get_cache_folder(url, fingerprint)
+
+  for outdated_folder in glob.glob(os.path.join(PARSED_CACHE_FOLDER, f"{glob.escape(os.path.basename(url))}.*")):
+
+    if outdated_folder != cache_folder:
+
+      shutil.rmtree(outdated_folder, ignore_errors=True)
+
+  os.makedirs(cache_folder, exist_ok=True)
+
+  for name, array in parsed_file.items():
+
+    np.save(os.path.join(cache_folder, f"{name}.npy"), array)
+
+  manifest = {
+
+    'version': CACHE_FORMAT_VERSION,
+
+    'network': NETWORK,
+
+    'source': os.path.basename(url),
+
+    **fingerprint,
+
+    'arrays': list(parsed_file.keys()),
+
+  }
+
+  with open(os.path.join(cache_folder, MANIFEST_FILE), 'w') as manifest_file:
+
+    json.dump(manifest, manifest_file, indent=2)
+
+  print(f"{check_mark} Saved parsed '{os.path.basename(url)}' to '{cache_folder}'")
+
+
+# The grid weights calculated from a land mask are cached in a single .npz file for each grid size, since the same land mask gives different weights on a different grid. They don't depend on the network, so they aren't cached with the parsed temperature files
+def get_grid_weights_path(url, fingerprint, grid_size):
+
+  return os.path.join(PARSED_CACHE_FOLDER, f"{os.path.basename(url)}.{fingerprint['hash'][:16]}.grid-{grid_size}.npz")
+
+
+# Load the grid weights calculated from a land mask for a grid size if they have been cached, otherwise return False
+def load_grid_weights(url, grid_size):
+
+  grid_weights_path = get_grid_weights_path(url, get_fingerprint(url), grid_size)
+
+  if not os.path.exists(grid_weights_path):
+
+    return False
+
+  with np.load(grid_weights_path) as grid_weights_file:
+
+    return { name: grid_weights_file[name] for name in grid_weights_file.files }
+
+
+# Save the grid weights calculated from a land mask for a grid size and remove those calculated from older versions of the land mask
+def save_grid_weights(url, grid_size, grid_weights):
+
+  fingerprint = get_fingerprint(url)
+
+  current_prefix = f"{os.path.basename(url)}.{fingerprint['hash'][:16]}."
+
+  for outdated_path in glob.glob(os.path.join(PARSED_CACHE_FOLDER, f"{glob.escape(os.path.basename(url))}.*.npz")):
+
+    if not os.path.basename(outdated_path).startswith(current_prefix):
+
+      os.remove(outdated_path)
+
+  os.makedirs(PARSED_CACHE_FOLDER, exist_ok=True)
+
+  grid_weights_path = get_grid_weights_path(url, fingerprint, grid_size)
+
+  # Written under another name first so an interrupted run never leaves a partial file to be loaded
+  with open(grid_weights_path + '.partial', 'wb') as grid_weights_file:
+
+    np.savez(grid_weights_file, **grid_weights)
+
+  os.replace(grid_weights_path + '.partial', grid_weights_path)
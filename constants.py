@@ -29,7 +29,7 @@ VERSION = 'v3'
 
   For GHCN v3 - 'qcu', 'qca'
   For GHCN v4 - 'qcu', 'qcf'
-  For GHCN daily - 'all'
+  For GHCN daily - 'all' (TAVG), 'tmax', 'tmin', 'dtr' (diurnal temperature range, TMAX minus TMIN)
   For USHCN v2.5 - 'raw', 'tob', 'FLs'
   For USCRN v1 - 'monthly01'
   
@@ -48,9 +48,28 @@ REFERENCE_RANGE = 30
 # Whether to purge all readings with Quality Control, Data Measurement, or Data Source flags
 PURGE_FLAGS = False
 
+# Whether to extract the downloaded .tar.gz archives to disk. When False, the files needed are read straight from the archives and only the parsed temperatures are saved (see CACHE_PARSED_TEMPERATURES). The GHCNd station files are compiled straight from ghcnd_all.tar.gz
+EXTRACT_ARCHIVES = True
+
+# Whether to save the parsed temperature file as binary arrays so later runs can load it in a fraction of the time. The saved arrays are parsed again automatically whenever the temperature file changes
+CACHE_PARSED_TEMPERATURES = True
+
 # The acceptable amount of data available (subtracting missing data) with which an anomaly calculation can be made (in decimal form)
 ACCEPTABLE_AVAILABLE_DATA_PERCENT = 0.5
 
+# How many processes to parse large temperature files with at the same time. Each process parses its own part of the file. The same number of processes compile the GHCNd station files, each compiling its own batches of stations. Set to the number of CPU cores to parse fastest, or 1 to parse in a single process
+INGEST_WORKERS = 1
+
+# Which monthly series to compile from the GHCN daily data in the same read of the station files: 'TAVG', 'TMAX', 'TMIN' and 'DTR'. The series of the daily dataset chosen in QUALITY_CONTROL_DATASET is always compiled, and the others are ready if you switch to them later
+DAILY_ELEMENTS = ['TAVG', 'TMAX', 'TMIN', 'DTR']
+
+# Whether to compile the GHCN daily data into GHCNm-like 'text' files, or into 'binary' arrays (.npz) that are loaded as they are without parsing any text
+DAILY_COMPILED_FORMAT = 'text'
+
+# Additional ways to weight each grid box when averaging all grid boxes together, besides the cosine and land ratio weightings. Each entry names the weighting and points to a CSV file with a "gridbox" column of grid box labels (Ex: "-87.5 lat -177.5 lon") and a "weight" column. Grid boxes missing from the file are left out of that average
+# Ex: { 'population': 'population-by-grid-box.csv' }
+GRID_WEIGHT_TABLES = {}
+
 # Whether to create a columns for each station's annual anomalies in the final Excel sheet. With the larger number of stations in the GHCNm v4, this will cause the program to crash at the end since 27,000 columns it too large for an excel file. But it is useful for testing purposes and smaller station amounts. When set to False, annual anomaly columns are printed for each grid quadrant instead.
 PRINT_STATION_ANOMALIES = False
 
@@ -7,191 +7,276 @@
 '''
 
 from globals import *
-import pandas as pd
 import numpy as np
 from termcolor import colored, cprint
 import os
+import glob
+import json
+import hashlib
+import contextlib
+import functools
+import itertools
+import multiprocessing
+import fixed_width
+import archives
 
 check_mark = colored(u'\u2713', 'green', attrs=['bold'])
 
 # All GHCNd .dly station files have 31 days even if some days are missing
 DAYS_IN_MONTH = 31
 
-def has_passing_flags(MFLAG, QFLAG, SFLAG):
+# The columns of each line of a .dly station file
+STATION_ID_COLUMN = (0, 11)
+
+YEAR_COLUMN = (11, 15)
+
+MONTH_COLUMN = (15, 17)
+
+ELEMENT_COLUMN = (17, 21)
+
+FIRST_DAY_INDEX = 21
+
+CHARACTERS_NEEDED_FOR_READING_AND_FLAGS = 8
+
+# Each day takes a 5 character reading followed by its three flags
+READING_WIDTH = 5
+
+LINE_WIDTH = FIRST_DAY_INDEX + DAYS_IN_MONTH * CHARACTERS_NEEDED_FOR_READING_AND_FLAGS
+
+# How many station files are compiled at a time, by each process when compiling with several processes
+STATION_FILES_PER_BATCH = 256
+
+# The manifests next to each compiled file let unchanged stations be copied into the next compile. The format is changed whenever the compiled rows would change, so that every station is compiled again
+DAILY_VERSION_FILE = 'ghcnd-version.txt'
+
+COMPILE_MANIFEST_EXTENSION = '.manifest.json'
+
+COMPILE_FORMAT_VERSION = 1
+
+# The file extension of each format the daily data can be compiled into (see DAILY_COMPILED_FORMAT in constants.py)
+COMPILED_EXTENSIONS = { 'text': '.dat', 'binary': '.npz' }
+
+# Each row of the binary format holds a station, year and the readings of its 12 months. The station IDs are gathered into a table once all stations are compiled
+COMPILED_ROW_TYPE = np.dtype([ ('station_id', 'S11'), ('year', np.int32), ('values', np.int16, 12) ])
+
+# The elements needed to compile the average temperature of each month
+TEMPERATURE_ELEMENTS = [ b'TMAX', b'TMIN' ]
+
+# The monthly series that can be compiled from the TMAX and TMIN of each day (see DAILY_ELEMENTS in constants.py), and the GHCNd dataset (QUALITY_CONTROL_DATASET) of each. DTR is the diurnal temperature range, the difference between TMAX and TMIN
+ELEMENTS_BY_DATASET = { 'all': 'TAVG', 'tmax': 'TMAX', 'tmin': 'TMIN', 'dtr': 'DTR' }
+
+'''
+  Customize which daily readings are used by their flags (see parse_daily_data for what each flag means). Each argument is a (lines x 31) array holding one flag for every day of the lines being parsed, as single bytes (dtype 'S1'), so compare them to bytes rather than strings. For example:
+
+    return (QFLAGS == b' ') & (MFLAGS != b'E')
+
+  Return True for the readings to keep, either as a (lines x 31) array of booleans or as a single boolean for all readings.
+'''
+def has_passing_flags(MFLAGS, QFLAGS, SFLAGS):
 
   return True
 
-def average_tmax_and_tmin(TMAX_AND_TMIN):
-
-  tavg = math.nan if len(TMAX_AND_TMIN) != 2 or TMAX_AND_TMIN.isnull().any() else int(normal_round(TMAX_AND_TMIN.mean()))
-
-  return tavg
-
-def parse_daily_row(unparsed_row):
-
-  parsed_row = []
-
-  ELEMENT = str(unparsed_row[17:21])
-
-  if not ELEMENT == "TMAX" and not ELEMENT == "TMIN":
-    return False
-
-  try:
-
-    STATION_ID = str(unparsed_row[0:11]).strip()
-    YEAR = int(unparsed_row[11:15])
-    MONTH = int(unparsed_row[15:17])
-
-    parsed_row.append(STATION_ID)
-    parsed_row.append(YEAR)
-    parsed_row.append(MONTH)
-    parsed_row.append(ELEMENT)
-
-    DAYS_IN_MONTH = 31
-    FIRST_DAY_INDEX = 21
-    CHARACTERS_NEEDED_FOR_READING_AND_FLAGS = 8
-
-    FULL_RANGE = (DAYS_IN_MONTH * CHARACTERS_NEEDED_FOR_READING_AND_FLAGS) + FIRST_DAY_INDEX
-
-    for index in range(FIRST_DAY_INDEX, FULL_RANGE, CHARACTERS_NEEDED_FOR_READING_AND_FLAGS):
-
-      # Temperature comes in tenths of degrees C
-      temperature_reading = int(unparsed_row[index:index + 5])
-
-      '''
-        https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/readme.txt
-        MFLAG1     is the measurement flag for the first day of the month.  There are
-                   ten possible values:
-
-                   Blank = no measurement information applicable
-                   B     = precipitation total formed from two 12-hour totals
-                   D     = precipitation total formed from four six-hour totals
-             H     = represents highest or lowest hourly temperature (TMAX or TMIN) 
-                     or the average of hourly values (TAVG)
-             K     = converted from knots 
-             L     = temperature appears to be lagged with respect to reported
-                     hour of observation 
-                   O     = converted from oktas 
-             P     = identified as "missing presumed zero" in DSI 3200 and 3206
-                   T     = trace of precipitation, snowfall, or snow depth
-             W     = converted from 16-point WBAN code (for wind direction)
-        
-      '''
-      MFLAG = str(unparsed_row[index+5:index+6])
-
-      '''
-        https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/readme.txt
-        QFLAG1     is the quality flag for the first day of the month.  There are 
-                   fourteen possible values:
-
-                   Blank = did not fail any quality assurance check
-                   D     = failed duplicate check
-                   G     = failed gap check
-                   I     = failed internal consistency check
-                   K     = failed streak/frequent-value check
-             L     = failed check on length of multiday period 
-                   M     = failed megaconsistency check
-                   N     = failed naught check
-                   O     = failed climatological outlier check
-                   R     = failed lagged range check
-                   S     = failed spatial consistency check
-                   T     = failed temporal consistency check
-                   W     = temperature too warm for snow
-                   X     = failed bounds check
-             Z     = flagged as a result of an official Datzilla 
-                     investigation
-      '''
-      QFLAG = str(unparsed_row[index+6:index+7])
-
-      '''
-        https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/readme.txt
-        SFLAG1     is the source flag for the first day of the month.  There are 
-                   thirty possible values (including blank, upper and 
-             lower case letters):
-
-                   Blank = No source (i.e., data value missing)
-                   0     = U.S. Cooperative Summary of the Day (NCDC DSI-3200)
-                   6     = CDMP Cooperative Summary of the Day (NCDC DSI-3206)
-                   7     = U.S. Cooperative Summary of the Day -- Transmitted 
-                     via WxCoder3 (NCDC DSI-3207)
-                   A     = U.S. Automated Surface Observing System (ASOS) 
-                           real-time data (since January 1, 2006)
-             a     = Australian data from the Australian Bureau of Meteorology
-                   B     = U.S. ASOS data for October 2000-December 2005 (NCDC 
-                           DSI-3211)
-             b     = Belarus update
-             C     = Environment Canada
-             D     = Short time delay US National Weather Service CF6 daily 
-                     summaries provided by the High Plains Regional Climate
-               Center
-             E     = European Climate Assessment and Dataset (Klein Tank 
-                     et al., 2002)     
-                   F     = U.S. Fort data 
-                   G     = Official Global Climate Observing System (GCOS) or 
-                           other government-supplied data
-                   H     = High Plains Regional Climate Center real-time data
-                   I     = International collection (non U.S. data received through
-                     personal contacts)
-                   K     = U.S. Cooperative Summary of the Day data digitized from
-                     paper observer forms (from 2011 to present)
-                   M     = Monthly METAR Extract (additional ASOS data)
-             m     = Data from the Mexican National Water Commission (Comision
-                     National del Agua -- CONAGUA)
-             N     = Community Collaborative Rain, Hail,and Snow (CoCoRaHS)
-             Q     = Data from several African countries that had been 
-                     "quarantined", that is, withheld from public release
-               until permission was granted from the respective 
-                     meteorological services
-                   R     = NCEI Reference Network Database (Climate Reference Network
-                     and Regional Climate Reference Network)
-             r     = All-Russian Research Institute of Hydrometeorological 
-                     Information-World Data Center
-                   S     = Global Summary of the Day (NCDC DSI-9618)
-                           NOTE: "S" values are derived from hourly synoptic reports
-                           exchanged on the Global Telecommunications System (GTS).
-                           Daily values derived in this fashion may differ significantly
-                           from "true" daily data, particularly for precipitation
-                           (i.e., use with caution).
-             s     = China Meteorological Administration/National Meteorological Information Center/
-                     Climatic Data Center (http://cdc.cma.gov.cn)
-                   T     = SNOwpack TELemtry (SNOTEL) data obtained from the U.S. 
-                     Department of Agriculture's Natural Resources Conservation Service
-             U     = Remote Automatic Weather Station (RAWS) data obtained
-                     from the Western Regional Climate Center    
-             u     = Ukraine update    
-             W     = WBAN/ASOS Summary of the Day from NCDC's Integrated 
-                     Surface Data (ISD).  
-                   X     = U.S. First-Order Summary of the Day (NCDC DSI-3210)
-             Z     = Datzilla official additions or replacements 
-             z     = Uzbekistan update
-             
-             When data are available for the same time from more than one source,
-             the highest priority source is chosen according to the following
-             priority order (from highest to lowest):
-             Z,R,D,0,6,C,X,W,K,7,F,B,M,m,r,E,z,u,b,s,a,G,Q,I,A,N,T,U,H,S
-      '''
-      SFLAG = str(unparsed_row[index+7:index+8])
-
-      corrected_temperature = math.nan if temperature_reading == -9999 or not has_passing_flags(MFLAG, QFLAG, SFLAG) else int(temperature_reading)
-
-      parsed_row.append(corrected_temperature)
-
-    return parsed_row
-
-  except:
+
+# Whether each reading passes has_passing_flags(). A result that doesn't fit the (lines x 31) readings fails here rather than quietly dropping readings
+def get_passing_flags(MFLAGS, QFLAGS, SFLAGS):
+
+  return np.broadcast_to(np.asarray(has_passing_flags(MFLAGS, QFLAGS, SFLAGS), dtype=bool), MFLAGS.shape)
+
+'''
+  Parse the contents of a .dly station file, given as bytes. Only lines of the `elements` wanted are kept, found by comparing the bytes of the element column of every line at once. The readings and flags of all 31 days of the kept lines are then decoded together as fixed-width views of the file's bytes (see fixed_width.py) rather than line by line.
+
+  Returns the station ID, year, month and element of each kept line, along with a (lines x 31) array of readings in tenths of a degree, with MISSING_VALUE for missing readings and readings that don't pass the flags, and (lines x 31) arrays of the three flags.
+'''
+def parse_daily_data(data, elements = TEMPERATURE_ELEMENTS):
+
+  data = np.frombuffer(data, dtype=np.uint8)
+
+  starts, lengths = fixed_width.find_lines(data)
+
+  element_of_line = fixed_width.decode_characters(fixed_width.to_columns(data, starts, lengths, ELEMENT_COLUMN[1]), ELEMENT_COLUMN)
+
+  is_needed = np.isin(element_of_line, elements)
+
+  starts, lengths = starts[is_needed], lengths[is_needed]
+
+  columns = fixed_width.to_columns(data, starts, lengths, LINE_WIDTH)
+
+  years, is_valid = fixed_width.decode_integers(columns, YEAR_COLUMN)
+
+  months, is_valid_month = fixed_width.decode_integers(columns, MONTH_COLUMN)
+
+  # A (31 days x 8 characters x lines) view of the readings and flags of every day
+  days = columns[FIRST_DAY_INDEX:LINE_WIDTH].reshape(DAYS_IN_MONTH, CHARACTERS_NEEDED_FOR_READING_AND_FLAGS, len(starts))
+
+  # Temperature comes in tenths of degrees C
+  readings, is_valid_reading = fixed_width.decode_integer_field(days[:, :READING_WIDTH].transpose(1, 0, 2))
+
+  # A line can only be used if every one of its readings can be read
+  is_valid &= is_valid_month & is_valid_reading.all(axis=0)
+
+  for invalid_row in np.flatnonzero(~is_valid):
 
     print(f"\nCould not parse row:")
-    print(unparsed_row)
+    print(fixed_width.get_line(data, starts[invalid_row], lengths[invalid_row]))
     print()
 
-    return False
+  '''
+    https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/readme.txt
+    MFLAG1     is the measurement flag for the first day of the month.  There are
+               ten possible values:
+
+               Blank = no measurement information applicable
+               B     = precipitation total formed from two 12-hour totals
+               D     = precipitation total formed from four six-hour totals
+         H     = represents highest or lowest hourly temperature (TMAX or TMIN) 
+                 or the average of hourly values (TAVG)
+         K     = converted from knots 
+         L     = temperature appears to be lagged with respect to reported
+                 hour of observation 
+               O     = converted from oktas 
+         P     = identified as "missing presumed zero" in DSI 3200 and 3206
+               T     = trace of precipitation, snowfall, or snow depth
+         W     = converted from 16-point WBAN code (for wind direction)
+    
+  '''
+  MFLAGS = days[:, READING_WIDTH].T.view('S1')
+
+  '''
+    https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/readme.txt
+    QFLAG1     is the quality flag for the first day of the month.  There are 
+               fourteen possible values:
+
+               Blank = did not fail any quality assurance check
+               D     = failed duplicate check
+               G     = failed gap check
+               I     = failed internal consistency check
+               K     = failed streak/frequent-value check
+         L     = failed check on length of multiday period 
+               M     = failed megaconsistency check
+               N     = failed naught check
+               O     = failed climatological outlier check
+               R     = failed lagged range check
+               S     = failed spatial consistency check
+               T     = failed temporal consistency check
+               W     = temperature too warm for snow
+               X     = failed bounds check
+         Z     = flagged as a result of an official Datzilla 
+                 investigation
+  '''
+  QFLAGS = days[:, READING_WIDTH + 1].T.view('S1')
+
+  '''
+    https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/readme.txt
+    SFLAG1     is the source flag for the first day of the month.  There are 
+               thirty possible values (including blank, upper and 
+         lower case letters):
+
+               Blank = No source (i.e., data value missing)
+               0     = U.S. Cooperative Summary of the Day (NCDC DSI-3200)
+               6     = CDMP Cooperative Summary of the Day (NCDC DSI-3206)
+               7     = U.S. Cooperative Summary of the Day -- Transmitted 
+                 via WxCoder3 (NCDC DSI-3207)
+               A     = U.S. Automated Surface Observing System (ASOS) 
+                       real-time data (since January 1, 2006)
+         a     = Australian data from the Australian Bureau of Meteorology
+               B     = U.S. ASOS data for October 2000-December 2005 (NCDC 
+                       DSI-3211)
+         b     = Belarus update
+         C     = Environment Canada
+         D     = Short time delay US National Weather Service CF6 daily 
+                 summaries provided by the High Plains Regional Climate
+           Center
+         E     = European Climate Assessment and Dataset (Klein Tank 
+                 et al., 2002)     
+               F     = U.S. Fort data 
+               G     = Official Global Climate Observing System (GCOS) or 
+                       other government-supplied data
+               H     = High Plains Regional Climate Center real-time data
+               I     = International collection (non U.S. data received through
+                 personal contacts)
+               K     = U.S. Cooperative Summary of the Day data digitized from
+                 paper observer forms (from 2011 to present)
+               M     = Monthly METAR Extract (additional ASOS data)
+         m     = Data from the Mexican National Water Commission (Comision
+                 National del Agua -- CONAGUA)
+         N     = Community Collaborative Rain, Hail,and Snow (CoCoRaHS)
+         Q     = Data from several African countries that had been 
+                 "quarantined", that is, withheld from public release
+           until permission was granted from the respective 
+                 meteorological services
+               R     = NCEI Reference Network Database (Climate Reference Network
+                 and Regional Climate Reference Network)
+         r     = All-Russian Research Institute of Hydrometeorological 
+                 Information-World Data Center
+               S     = Global Summary of the Day (NCDC DSI-9618)
+                       NOTE: "S" values are derived from hourly synoptic reports
+                       exchanged on the Global Telecommunications System (GTS).
+                       Daily values derived in this fashion may differ significantly
+                       from "true" daily data, particularly for precipitation
+                       (i.e., use with caution).
+         s     = China Meteorological Administration/National Meteorological Information Center/
+                 Climatic Data Center (http://cdc.cma.gov.cn)
+               T     = SNOwpack TELemtry (SNOTEL) data obtained from the U.S. 
+                 Department of Agriculture's Natural Resources Conservation Service
+         U     = Remote Automatic Weather Station (RAWS) data obtained
+                 from the Western Regional Climate Center    
+         u     = Ukraine update    
+         W     = WBAN/ASOS Summary of the Day from NCDC's Integrated 
+                 Surface Data (ISD).  
+               X     = U.S. First-Order Summary of the Day (NCDC DSI-3210)
+         Z     = Datzilla official additions or replacements 
+         z     = Uzbekistan update
+         
+         When data are available for the same time from more than one source,
+         the highest priority source is chosen according to the following
+         priority order (from highest to lowest):
+         Z,R,D,0,6,C,X,W,K,7,F,B,M,m,r,E,z,u,b,s,a,G,Q,I,A,N,T,U,H,S
+  '''
+  SFLAGS = days[:, READING_WIDTH + 2].T.view('S1')
+
+  readings = readings.T
+
+  readings = np.where((readings == MISSING_VALUE) | ~get_passing_flags(MFLAGS, QFLAGS, SFLAGS), MISSING_VALUE, readings)
+
+  return {
+
+    'station_id': np.char.strip(fixed_width.decode_characters(columns, STATION_ID_COLUMN)[is_valid]).astype(str),
+
+    'year': years[is_valid],
+
+    'month': months[is_valid],
+
+    'element': element_of_line[is_needed][is_valid],
+
+    'values': readings[is_valid],
+
+    'measurement_flags': MFLAGS[is_valid],
+
+    'quality_flags': QFLAGS[is_valid],
+
+    'source_flags': SFLAGS[is_valid],
+
+  }
+
+# Get the version of the daily data
+def read_daily_version():
+
+  return open(DAILY_VERSION_FILE, 'r').read()[37:56]
+
+
+# Each version of the daily data is compiled into its own file for each element
+def get_compiled_file_url(DAILY_VERSION, ELEMENT = 'TAVG'):
+
+  return f"./ghcnd.{ELEMENT.lower()}.{DAILY_VERSION}.all{COMPILED_EXTENSIONS[DAILY_COMPILED_FORMAT]}"
+
 
 def gather_daily_station_files(FOLDER_WITH_DAILY_DATA):
 
   # Find all station data files in folder
   daily_station_files = []
 
-  all_stations = os.listdir(FOLDER_WITH_DAILY_DATA)
+  # Sorted so the stations are compiled in the same order on every machine, whatever order the file system lists them in
+  all_stations = sorted(os.listdir(FOLDER_WITH_DAILY_DATA))
 
   # Create an array of all our .dly station file URLs
   for station_file_url in all_stations:
@@ -200,97 +285,449 @@ def gather_daily_station_files(FOLDER_WITH_DAILY_DATA):
 
   return daily_station_files
 
-def compile_daily_data(DAILY_VERSION, FOLDER_WITH_DAILY_DATA):
+# Average the available days of each line. We multiply each temperature by 10 to keep it consistent with GHCNm. Lines without any readings average to NaN
+def average_days(values):
 
-  # Prepare our mega file to save all combined station temperatures too
-  OUTPUT_FILE_URL = f"./ghcnd.tavg.{DAILY_VERSION}.all.dat"
+  is_available = values != MISSING_VALUE
 
-  if os.path.exists(OUTPUT_FILE_URL):
-    
-    os.remove(OUTPUT_FILE_URL)
+  count = is_available.sum(axis=1)
+
+  # Readings are whole tenths of a degree, so their sums are exact
+  total = np.where(is_available, values, 0).sum(axis=1)
+
+  return normal_round_array(np.where(count > 0, total / np.maximum(count, 1), math.nan) * 10)
+
+
+'''
+  Combine the TMAX and TMIN averages of each month into the monthly series of each of the `elements`. The lines are joined on their station, year and month by giving each (station, year, month) a cell in a (stations x years x months) table, so the lines of every month are added up together with bincounts.
+
+  A month only gets a TAVG when it has exactly two lines and both have an average. It only gets a TMAX or TMIN when it has exactly one line of that element with an average, and a DTR when it has both. Every year of every station gets a row, even if some have no value.
+
+  Returns the station ID and year of each row, with a (rows x months) array for each element that is NaN where missing, and the months they are for.
+'''
+def combine_tmax_and_tmin(station_ids, years, months, line_elements, averages, elements = [ 'TAVG' ]):
+
+  unique_station_ids, station_codes = np.unique(station_ids, return_inverse=True)
+
+  unique_years, year_codes = np.unique(years, return_inverse=True)
+
+  unique_months, month_codes = np.unique(months, return_inverse=True)
+
+  total_rows = len(unique_station_ids) * len(unique_years)
+
+  cells = (station_codes * len(unique_years) + year_codes) * len(unique_months) + month_codes
+
+  total_cells = total_rows * len(unique_months)
+
+  is_available = ~np.isnan(averages)
+
+  # The number of lines, the number of them with an average, and the total of their averages within each cell
+  def add_up(is_line):
+
+    return (
+
+      np.bincount(cells, weights=is_line, minlength=total_cells),
+
+      np.bincount(cells, weights=is_line & is_available, minlength=total_cells),
+
+      np.bincount(cells, weights=np.where(is_line & is_available, averages, 0), minlength=total_cells),
+
+    )
+
+  lines_in_cell, available_in_cell, total_in_cell = add_up(np.ones(len(cells), dtype=bool))
+
+  tmax_lines, tmax_available, tmax_total = add_up(line_elements == b'TMAX')
+
+  tmin_lines, tmin_available, tmin_total = add_up(line_elements == b'TMIN')
+
+  has_tmax = (tmax_lines == 1) & (tmax_available == 1)
+
+  has_tmin = (tmin_lines == 1) & (tmin_available == 1)
+
+  monthly_series = {
+
+    'TAVG': lambda: np.where((lines_in_cell == 2) & (available_in_cell == 2), normal_round_array(total_in_cell / 2), math.nan),
+
+    'TMAX': lambda: np.where(has_tmax, tmax_total, math.nan),
+
+    'TMIN': lambda: np.where(has_tmin, tmin_total, math.nan),
+
+    'DTR': lambda: np.where(has_tmax & has_tmin, tmax_total - tmin_total, math.nan),
+
+  }
+
+  values_by_element = { element: monthly_series[element]().reshape(total_rows, len(unique_months)) for element in elements }
+
+  return np.repeat(unique_station_ids, len(unique_years)), np.tile(unique_years, len(unique_station_ids)), values_by_element, unique_months
+
+
+# Format the GHCNm-like rows of all years of a station at once, with -9999 for missing months
+def format_monthly_rows(station_ids, years, monthly_values, element):
+
+  monthly_values = np.where(np.isnan(monthly_values), MISSING_VALUE, monthly_values).astype(np.int64)
+
+  output_rows = np.char.add(np.char.add(np.char.add('\n', station_ids), years.astype(str)), element.ljust(4))
+
+  for month_strings in np.char.rjust(monthly_values.astype(str), 5).T:
+
+    output_rows = np.char.add(np.char.add(output_rows, month_strings), '   ')
+
+  return ''.join(output_rows)
+
+
+# Arrange the rows of all years of a station in the binary format (see COMPILED_ROW_TYPE), with -9999 for missing months
+def to_binary_rows(station_ids, years, monthly_values):
+
+  rows = np.empty(len(years), dtype=COMPILED_ROW_TYPE)
+
+  rows['station_id'] = station_ids
+
+  rows['year'] = years
+
+  rows['values'] = np.where(np.isnan(monthly_values), MISSING_VALUE, monthly_values)
+
+  return rows
+
+
+# The rows of a station in the format being compiled into. Text rows are returned as bytes
+def format_compiled_rows(station_ids, years, monthly_values, element):
+
+  if DAILY_COMPILED_FORMAT == 'binary':
+
+    return to_binary_rows(station_ids, years, monthly_values)
+
+  return format_monthly_rows(station_ids, years, monthly_values, element).encode()
+
+
+# Station files in an archive are read while reading through the archive, while those in a folder are read by the process compiling them
+def read_station_file(station_file):
+
+  if isinstance(station_file, bytes):
+
+    return station_file
+
+  with open(station_file, 'rb') as opened_station_file:
+
+    return opened_station_file.read()
+
+
+'''
+  Turn a .dly station file into the GHCNm-like monthly rows of the station for each of the `elements`, in the format being compiled into (see format_compiled_rows). Stations without enough data have no rows.
+
+  Returns the size and hash of the station file along with its rows by element. If the file is the same as when it was last compiled (`previous_station`, see read_compile_manifest), it isn't compiled again and no rows are returned, since they can be copied from the previous compiled files.
+'''
+def compile_station_file(station_file, previous_station = None, elements = [ 'TAVG' ]):
+
+  data = read_station_file(station_file)
+
+  station = { 'size': len(data), 'hash': hashlib.sha256(data).hexdigest() }
+
+  if previous_station and previous_station['size'] == station['size'] and previous_station['hash'] == station['hash']:
+
+    return station, None
+
+  parsed = parse_daily_data(data)
+
+  station_ids, years, values_by_element, months = combine_tmax_and_tmin(parsed['station_id'], parsed['year'], parsed['month'], parsed['element'], average_days(parsed['values']), elements)
+
+  # Only stations with data in all 12 months, and more than one row, are kept
+  if len(months) != 12 or len(years) <= 1:
+
+    return station, { element: format_compiled_rows(station_ids[:0], years[:0], np.empty((0, 12)), element) for element in elements }
+
+  return station, { element: format_compiled_rows(station_ids, years, values_by_element[element], element) for element in elements }
+
+
+# Compile a batch of (name, station file, previous station) entries. Returns the name of each station file with what compile_station_file returned
+def compile_station_files(batch, elements):
+
+  return [ (name, *compile_station_file(station_file, previous_station, elements)) for name, station_file, previous_station in batch ]
+
+
+'''
+  Divide the .dly station files into batches of (name, station file) pairs. FOLDER_WITH_DAILY_DATA is either a folder or, to compile without extracting ghcnd_all.tar.gz, the path of the folder within the archive (Ex: 'ghcnd_all.tar.gz/ghcnd_all'). The archive is read through once, a batch at a time, and each station file is held in memory only until its batch is compiled, so nothing is written to disk.
+'''
+def gather_station_file_batches(FOLDER_WITH_DAILY_DATA):
+
+  archive, folder = archives.split_archive_path(FOLDER_WITH_DAILY_DATA)
+
+  if archive is None:
+
+    station_files = ( (os.path.basename(path), path) for path in gather_daily_station_files(FOLDER_WITH_DAILY_DATA) )
+
+  else:
+
+    station_files = ( (os.path.basename(path), contents) for path, contents in archives.iterate_files(archive, f"{folder}/*dly*") )
+
+  batch = list(itertools.islice(station_files, STATION_FILES_PER_BATCH))
+
+  while batch:
+
+    yield batch
+
+    batch = list(itertools.islice(station_files, STATION_FILES_PER_BATCH))
+
+
+# Compile the batches with a pool of processes. Only a few batches are handed to the pool at a time, so batches read from an archive don't pile up in memory faster than they are compiled
+def compile_batches_with_pool(pool, batches, elements):
+
+  window = list(itertools.islice(batches, 2 * INGEST_WORKERS))
+
+  while window:
+
+    yield from pool.imap(functools.partial(compile_station_files, elements=elements), window)
+
+    window = list(itertools.islice(batches, 2 * INGEST_WORKERS))
+
+
+'''
+  The manifest of a compiled file lists the size and hash of every station file that went into it, along with the offset and length in bytes of the rows of each station within the compiled file. It lets the next compile copy the rows of unchanged stations instead of compiling them again.
+'''
+def get_manifest_url(compiled_file_url):
+
+  return compiled_file_url + COMPILE_MANIFEST_EXTENSION
+
+
+# Returns the stations of a compiled file by the name of their station files, or an empty dict if the file has no manifest or was compiled differently
+def read_compile_manifest(compiled_file_url):
+
+  if not compiled_file_url or not os.path.exists(compiled_file_url) or not os.path.exists(get_manifest_url(compiled_file_url)):
+
+    return {}
+
+  with open(get_manifest_url(compiled_file_url), 'r') as manifest_file:
+
+    manifest = json.load(manifest_file)
+
+  if manifest.get('format') != COMPILE_FORMAT_VERSION or manifest.get('size') != os.path.getsize(compiled_file_url):
+
+    return {}
+
+  return manifest['stations']
+
+
+def write_compile_manifest(compiled_file_url, stations):
+
+  with open(get_manifest_url(compiled_file_url), 'w') as manifest_file:
+
+    json.dump({ 'format': COMPILE_FORMAT_VERSION, 'size': os.path.getsize(compiled_file_url), 'stations': stations }, manifest_file)
+
+
+# The most recently compiled file of an element that has a manifest, whose unchanged stations can be copied into a new compile
+def find_previous_compile(ELEMENT):
+
+  compiled_files = [ compiled_file_url for compiled_file_url in glob.glob(get_compiled_file_url('*', ELEMENT)) if os.path.exists(get_manifest_url(compiled_file_url)) ]
+
+  return max(compiled_files, key=os.path.getmtime) if compiled_files else None
+
+
+# Stations can only be copied if they are the same in the previous compiles of every element, so only the stations found unchanged in all of them are kept
+def get_stations_in_every_compile(stations_by_element):
+
+  stations_by_element = list(stations_by_element.values())
+
+  return {
+
+    name: station for name, station in stations_by_element[0].items()
+
+    if all(name in stations and (stations[name]['size'], stations[name]['hash']) == (station['size'], station['hash']) for stations in stations_by_element[1:])
+
+  }
+
+
+# Load daily data compiled into the binary format as the same arrays the temperatures parser makes from text (see temperatures.parse_temperature_file)
+def load_compiled_daily_data(compiled_file_url):
+
+  with np.load(compiled_file_url) as compiled_file:
+
+    return { name: compiled_file[name] for name in compiled_file.files }
+
+
+# Save the rows of every station as the arrays the temperatures loader expects, gathering the station IDs into a sorted table that each row points into
+def save_binary_rows(OUTPUT_CONTENT, blocks):
+
+  rows = np.concatenate(blocks) if blocks else np.empty(0, dtype=COMPILED_ROW_TYPE)
+
+  station_ids, station_codes = np.unique(rows['station_id'], return_inverse=True)
+
+  np.savez(
+
+    OUTPUT_CONTENT,
+
+    station_ids=station_ids,
+
+    station_code=station_codes.astype(np.int32),
+
+    year=rows['year'],
+
+    values=np.ascontiguousarray(rows['values']),
+
+    # Compiled daily data has no flags
+    flags=np.zeros(rows['values'].shape, dtype=np.uint8),
+
+  )
+
+
+# Open a previous compiled file to copy rows from. Binary files are loaded as rows in the binary format
+def open_previous_compile(stack, previous_file_url):
+
+  if DAILY_COMPILED_FORMAT == 'binary':
+
+    compiled = load_compiled_daily_data(previous_file_url)
+
+    rows = np.empty(len(compiled['year']), dtype=COMPILED_ROW_TYPE)
+
+    rows['station_id'], rows['year'], rows['values'] = compiled['station_ids'][ compiled['station_code'] ], compiled['year'], compiled['values']
+
+    return rows
+
+  return stack.enter_context(open(previous_file_url, 'rb'))
+
+
+# The rows of a station within a previous compiled file. The offset and length count bytes in text files and rows in binary files
+def read_previous_rows(previous_content, previous_station):
+
+  start, end = previous_station['offset'], previous_station['offset'] + previous_station['length']
+
+  if isinstance(previous_content, np.ndarray):
+
+    return previous_content[start:end]
+
+  previous_content.seek(start)
+
+  return previous_content.read(end - start)
+
+
+# Add the rows of a station to a compiled file. Text rows are written as they come, while binary rows are kept until all stations are compiled
+def append_rows(output, rows):
+
+  if isinstance(rows, bytes):
+
+    output['file'].write(rows)
+
+  else:
+
+    output['blocks'].append(rows)
+
+  output['size'] += len(rows)
+
+
+'''
+  Write the rows of each batch of station files as they are compiled to the output of each element, in the order of the batches. Stations that weren't compiled again are copied from the previous compiled files. Returns the manifest of the new compiled file of each element (see read_compile_manifest) and how many stations were copied.
+'''
+def write_compiled_batches(compiled_batches, outputs, previous_files, previous_stations_by_element):
+
+  stations_by_element = { element: {} for element in outputs }
+
+  stations_composed, stations_copied = 0, 0
+
+  with contextlib.ExitStack() as stack:
+
+    previous_contents = { element: open_previous_compile(stack, previous_file_url) for element, previous_file_url in previous_files.items() }
+
+    for compiled_batch in compiled_batches:
+
+      for name, station, rows_by_element in compiled_batch:
+
+        stations_composed += 1
+
+        stations_copied += rows_by_element is None
+
+        for element, output in outputs.items():
+
+          if rows_by_element is None:
+
+            rows = read_previous_rows(previous_contents[element], previous_stations_by_element[element][name])
+
+          else:
+
+            rows = rows_by_element[element]
+
+          stations_by_element[element][name] = { **station, 'offset': output['size'], 'length': len(rows) }
+
+          append_rows(output, rows)
+
+      print(f"Composed {stations_composed} station files")
+
+  return stations_by_element, stations_copied
+
+
+'''
+  Compile every .dly station file into a GHCNm-like file of monthly rows for each of the `ELEMENTS` ('TAVG', 'TMAX', 'TMIN' or 'DTR'), all from a single read of the station files. The rows are written as text, or as binary arrays that load without being parsed (see DAILY_COMPILED_FORMAT). The station files are compiled in batches (see gather_station_file_batches). With INGEST_WORKERS above 1, the batches are compiled at the same time by separate processes, started by forking this one, while this process writes the rows of each batch in the same order the stations would be compiled in one at a time, so the files are the same either way.
+
+  If previous compiled files and their manifests exist for every element, such as those of the last version of the daily data, only new and changed station files are compiled. The rows of the rest are copied from the previous files into the new ones, after which the previous files are removed.
+
+  Returns the compiled file of each element.
+'''
+def compile_daily_data(DAILY_VERSION, FOLDER_WITH_DAILY_DATA, ELEMENTS = [ 'TAVG' ]):
+
+  # Prepare our mega files to save all combined station temperatures too
+  output_file_urls = { element: get_compiled_file_url(DAILY_VERSION, element) for element in ELEMENTS }
+
+  print(f"\nCompiling daily data into GHCNm-like monthly files to be named:")
+  print('  ' + '\n  '.join(output_file_urls.values()) + '\n')
+
+  previous_files = { element: find_previous_compile(element) for element in ELEMENTS }
+
+  previous_stations_by_element = { element: read_compile_manifest(previous_file_url) for element, previous_file_url in previous_files.items() }
+
+  previous_stations = get_stations_in_every_compile(previous_stations_by_element)
 
-  print(f"\nCompiling daily data into a GHCNm-like monthly TAVG file to be named '{OUTPUT_FILE_URL}'\n")
+  if previous_stations:
 
-  # Prepare the file for editing
-  OUTPUT_CONTENT = open(OUTPUT_FILE_URL, 'a')
+    print(f"Only compiling the station files that changed since '{previous_files[ELEMENTS[0]]}'\n")
 
-  daily_station_files = gather_daily_station_files(FOLDER_WITH_DAILY_DATA)
+  else:
 
-  total_stations = len(daily_station_files)
+    previous_files = {}
 
-  station_iterator = 0
+  batches = (
 
-  # For each daily station file
-  for station_file_url in daily_station_files:
+    [ (name, station_file, previous_stations.get(name)) for name, station_file in batch ] for batch in gather_station_file_batches(FOLDER_WITH_DAILY_DATA)
 
-    station_iterator += 1
+  )
 
-    print(f"Composing station {station_iterator} of {total_stations}")
+  # The new files are written next to the previous ones, which may have the same names, and only take their places once complete
+  with contextlib.ExitStack() as stack:
 
-    # Read the station file. We will manually parse each line instead of relying on colspecs to improve performance
-    station_daily_values = pd.read_csv(station_file_url, header=None)
+    outputs = { element: { 'file': stack.enter_context(open(output_file_url + '.partial', 'wb')), 'blocks': [], 'size': 0 } for element, output_file_url in output_file_urls.items() }
 
-    # Prepare our columns
-    columns = [ 'station_id', 'year', 'month', 'element' ]
+    if INGEST_WORKERS > 1 and 'fork' in multiprocessing.get_all_start_methods():
 
-    for day in range(DAYS_IN_MONTH):
+      pool = stack.enter_context(multiprocessing.get_context('fork').Pool(INGEST_WORKERS))
 
-      columns.append('value' + str(day + 1))
+      compiled_batches = compile_batches_with_pool(pool, batches, ELEMENTS)
 
-    # Prepare to combine all parsed lines into one array
-    parsed_lines = []
+    else:
 
-    # Manually parse each line of the station data
-    for file_row in station_daily_values.values:
+      compiled_batches = ( compile_station_files(batch, ELEMENTS) for batch in batches )
 
-      parsed_row = parse_daily_row(file_row[0])
+    stations_by_element, stations_copied = write_compiled_batches(compiled_batches, outputs, previous_files, previous_stations_by_element)
 
-      if parsed_row:
+    if DAILY_COMPILED_FORMAT == 'binary':
 
-        parsed_lines.append(parsed_row)
+      for output in outputs.values():
 
-    # Convert the parsed file rows into a dataframe
-    station_temperature_data = pd.DataFrame(parsed_lines, columns=columns)
+        save_binary_rows(output['file'], output['blocks'])
 
-    # Average daily values for Each (Year, Month, Element) combo
-    # We multiply each temperature by 10 to keep it consistent with GHCNm
-    station_temperature_data['average'] = station_temperature_data.iloc[:,3:].mean(
-      axis=1, 
-      skipna=True, 
-      level=None, 
-      numeric_only=True
-    ).apply(lambda d : d if math.isnan(d) else int(normal_round(d * 10))).astype('Int64')
+  for element, output_file_url in output_file_urls.items():
 
-    # Since we now have the averages of all days, we no longer need the daily values, so drop them
-    station_temperature_data.drop(station_temperature_data.columns[3:34], axis=1, inplace=True)
+    previous_file_url = find_previous_compile(element)
 
-    # Transform vertical month columns to horizontal row columns on the year and average TMAX and TMIN averages to combine them
-    station_temperature_data = station_temperature_data.pivot_table(
-      index=["station_id", "year"], 
-      columns='month', 
-      values='average', 
-      fill_value=math.nan, 
-      aggfunc=average_tmax_and_tmin, 
-      dropna=False
-    ).astype('Int64').reset_index()
+    if previous_file_url and os.path.abspath(previous_file_url) != os.path.abspath(output_file_url):
 
-    # If the file has 12 columns, one for each month
-    if len(station_temperature_data.columns) == 14 and len(station_temperature_data.values) > 1:
+      os.remove(previous_file_url)
 
-      # For each row in the station's data
-      for year, row in station_temperature_data.iterrows():
+      os.remove(get_manifest_url(previous_file_url))
 
-        # Create a representative string line to save in the output file
-        output_row_string = f"\n{row['station_id']}{row['year']}TAVG"
+    os.replace(output_file_url + '.partial', output_file_url)
 
-        for month in range(1, 13):
+    write_compile_manifest(output_file_url, stations_by_element[element])
 
-          month_string = str(row[month]).replace('<NA>', '-9999').rjust(5, " ")
-          output_row_string = output_row_string + f"{month_string}   "
+  if stations_copied:
 
-        # Add the representative line to the output file
-        OUTPUT_CONTENT.write(output_row_string)
+    print(f"\n{check_mark} Copied {stations_copied} unchanged station files from the previous compile")
 
-  print(f"\n{check_mark} Daily station data compiled into '{OUTPUT_FILE_URL}'\n")
+  print(f"\n{check_mark} Daily station data compiled into '" + "', '".join(output_file_urls.values()) + "'\n")
 
-  return OUTPUT_FILE_URL
+  return output_file_urls
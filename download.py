@@ -50,8 +50,9 @@
 from globals import *
 
 import urllib.request
-import tarfile
 import os
+import archives
+import daily
 from google_drive_downloader import GoogleDriveDownloader as gdd
 from termcolor import colored, cprint
 
@@ -93,6 +94,24 @@ REQUIRED_DOWNLOADS = {
         'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-countries.txt',
         'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-stations.txt',
         'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd_all.tar.gz'
+      ],
+      'tmax': [
+        'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-version.txt',
+        'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-countries.txt',
+        'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-stations.txt',
+        'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd_all.tar.gz'
+      ],
+      'tmin': [
+        'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-version.txt',
+        'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-countries.txt',
+        'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-stations.txt',
+        'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd_all.tar.gz'
+      ],
+      'dtr': [
+        'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-version.txt',
+        'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-countries.txt',
+        'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-stations.txt',
+        'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd_all.tar.gz'
       ]
     }
 
@@ -139,10 +158,6 @@ LAND_MASK_URL = 'https://drive.google.com/uc?export=download&id=1nSDlTfMbyquCQfl
 
 DAILY_ARCHIVE_FILE = 'ghcnd_all.tar.gz'
 
-EXTRACTED_DAILY_FOLDER = 'ghcnd_all'
-
-COMPILED_DAILY = 'ghcnd.tavg*.dat'
-
 # Exception
 
 v3_unadjusted = 'https://www1.ncdc.noaa.gov/pub/data/ghcn/v3/ghcnm.tavg.latest.qcu.tar.gz'
@@ -211,45 +226,23 @@ def download_if_needed(urls):
 
   return downloaded_files
 
-# Check if any file in the files to be extracted doesn't already exist, then it needs to be extracted
-def needs_extraction(files_to_be_extracted):
-
-  for potential_extraction in files_to_be_extracted:
-
-    if not os.path.exists(potential_extraction):
-
-      return True
-
-# For each file provided, check if the file is zipped and if its unzipped contents don't already exist, unzip the file
+# For each file provided, check if the file is zipped and if its unzipped contents don't already exist, unzip the file. Whether anything is missing is checked against the manifest of each archive, so archives that are already extracted aren't decompressed again
 def extract_if_needed(downloaded_files):
 
   for file_name in downloaded_files:
 
-    if file_name.endswith('.tar.gz'):
-
-      file_preview = tarfile.open(file_name, mode="r|gz")
-
-      # See the names of the files to be unzipped without actually extracting them
-      files_to_be_extracted = file_preview.getnames()
-
-      is_needing_extraction = needs_extraction(files_to_be_extracted)
+    if file_name.endswith('.tar.gz') and archives.needs_extraction(file_name):
 
-      if is_needing_extraction:
+      archives.extract_archive(file_name)
 
-        print(f"Extracting '{file_name}' to:")
-
-        tarfile.open(file_name, mode="r|gz").extractall()
-
-        print(f'  {check_mark} ' + f'\n  {check_mark} '.join(files_to_be_extracted)) 
-
-# If the compiled daily data exists, or if the daily data folder is already extracted, do nothing. Otherwise, extract the daily data.
+# If this version of the daily data is already compiled, or if the daily data is already extracted, do nothing. Otherwise, extract the daily data.
 def extract_daily_if_needed():
 
   if NETWORK == 'GHCN':
 
-    if not os.path.exists(COMPILED_DAILY) and not os.path.exists(EXTRACTED_DAILY_FOLDER):
+    if not os.path.exists(daily.get_compiled_file_url(daily.read_daily_version(), daily.ELEMENTS_BY_DATASET[QUALITY_CONTROL_DATASET])) and archives.needs_extraction(DAILY_ARCHIVE_FILE):
 
-      tarfile.open(DAILY_ARCHIVE_FILE, mode="r|gz").extractall()
+      archives.extract_archive(DAILY_ARCHIVE_FILE)
 
 
 # Download and compile the necessary files and return the associated STATION_FILE_PATH, TEMPERATURES_FILE_PATH, COUNTRIES_FILE_PATH for the given NETWORK, VERSION, and QUALITY_CONTROL_DATASET
@@ -268,7 +261,18 @@ def get_files():
 
   downloaded_files = download_if_needed(downloadables)
   
-  extract_daily_if_needed() if VERSION == 'daily' else extract_if_needed(downloaded_files) 
+  # Files that haven't been extracted can still be read from within their archives. The daily archive is only read through when compiling it, so it isn't searched for other files
+  archives.use_archives([ file_name for file_name in downloaded_files if file_name != DAILY_ARCHIVE_FILE ])
+
+  if VERSION == 'daily':
+
+    if EXTRACT_ARCHIVES:
+
+      extract_daily_if_needed()
+
+  elif EXTRACT_ARCHIVES:
+
+    extract_if_needed(downloaded_files)
 
   download_landmask_data_if_needed()
   
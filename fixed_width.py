@@ -0,0 +1,226 @@
+'''
+  Decodes fixed-width text files (GHCNm, USHCN, the GHCNd .dly station files and the compiled GHCNd/USCRN .dat files) one column at a time instead of one line at a time. The file is read as raw bytes and each column is gathered for every line at once with NumPy, using the same (start, end) boundaries found in each network's DATA_COLUMNS.
+'''
+
+import numpy as np
+import os
+
+NEWLINE = ord('\n')
+
+CARRIAGE_RETURN = ord('\r')
+
+SPACE = ord(' ')
+
+MINUS = ord('-')
+
+ZERO = ord('0')
+
+NINE = ord('9')
+
+# How many bytes to look through at a time when searching for the end of a line
+LINE_SEARCH_BYTES = 4096
+
+
+# Memory-map a file as an array of bytes. Only the parts of the file that are used get read from disk, and they don't count against the memory of the program
+def map_file(url):
+
+  if os.path.getsize(url) == 0:
+
+    return np.zeros(0, dtype=np.uint8)
+
+  return np.memmap(url, dtype=np.uint8, mode='r')
+
+
+# The number of lines in the buffer, counting blank lines, which makes it the most lines find_lines can return
+def count_lines(data):
+
+  return np.count_nonzero(data == NEWLINE) + (1 if len(data) and data[-1] != NEWLINE else 0)
+
+
+# Divide data[start:end] into chunks of about `chunk_bytes` that each end just after a newline, so no line is split between two chunks
+def split_into_line_chunks(data, start, end, chunk_bytes):
+
+  chunks = []
+
+  chunk_start = start
+
+  while chunk_start < end:
+
+    chunk_end = min(chunk_start + chunk_bytes, end)
+
+    # Extend the chunk to the end of the line it stops in
+    while chunk_end < end and data[chunk_end - 1] != NEWLINE:
+
+      newlines = np.flatnonzero(data[chunk_end : min(chunk_end + LINE_SEARCH_BYTES, end)] == NEWLINE)
+
+      chunk_end = chunk_end + newlines[0] + 1 if len(newlines) else min(chunk_end + LINE_SEARCH_BYTES, end)
+
+    chunks.append((chunk_start, chunk_end))
+
+    chunk_start = chunk_end
+
+  return chunks
+
+
+# Return the starting offset and length of every non-blank line in the buffer
+def find_lines(data):
+
+  if not len(data):
+
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+  line_ends = np.flatnonzero(data == NEWLINE)
+
+  # The last line may not end with a newline
+  if data[-1] != NEWLINE:
+
+    line_ends = np.append(line_ends, len(data))
+
+  starts = np.concatenate(([0], line_ends[:-1] + 1)).astype(np.int64)
+
+  lengths = line_ends - starts
+
+  # Ignore the carriage return of files saved with Windows line endings
+  has_carriage_return = (lengths > 0) & (data[np.maximum(line_ends - 1, 0)] == CARRIAGE_RETURN)
+
+  lengths = lengths - has_carriage_return
+
+  # Blank lines carry no data (the compiled daily files start with one)
+  is_not_blank = lengths > 0
+
+  return starts[is_not_blank], lengths[is_not_blank]
+
+
+# Divide a file into about `total_ranges` byte ranges of at least `minimum_bytes` each, so that every range begins at the start of a line and ends just after a newline (or at the end of the file)
+def split_into_line_ranges(url, total_ranges, minimum_bytes = 0):
+
+  file_size = os.path.getsize(url)
+
+  total_ranges = max(1, min(total_ranges, file_size // max(minimum_bytes, 1)))
+
+  range_starts = [0]
+
+  with open(url, 'rb') as file_to_split:
+
+    for range_index in range(1, total_ranges):
+
+      file_to_split.seek(max(file_size * range_index // total_ranges, range_starts[-1]))
+
+      # Move to the start of the next line
+      file_to_split.readline()
+
+      range_starts.append(file_to_split.tell())
+
+  range_ends = range_starts[1:] + [file_size]
+
+  return [ (start, end) for start, end in zip(range_starts, range_ends) if end > start ]
+
+
+# Lines are gathered and transposed this many at a time to keep the temporary arrays small and within the CPU cache
+LINES_PER_GATHER = 8192
+
+
+'''
+  Arrange the first `width` characters of every line into a (width x lines) array, so that columns[offset] holds the character at that offset for every line and each fixed-width field becomes a contiguous slice. Lines that are too short are padded with spaces.
+'''
+def to_columns(data, starts, lengths, width):
+
+  total_lines = len(starts)
+
+  columns = np.full((width, total_lines), SPACE, dtype=np.uint8)
+
+  # When every line has the same length, as in the files published by NOAA, the lines can be read directly as a strided view of the file's bytes
+  if total_lines and lengths.min() >= width:
+
+    stride = starts[1] - starts[0] if total_lines > 1 else width
+
+    if np.all(np.diff(starts) == stride):
+
+      lines = np.lib.stride_tricks.as_strided(data[starts[0]:], shape=(total_lines, width), strides=(stride, 1), writeable=False)
+
+      for first_line in range(0, total_lines, LINES_PER_GATHER):
+
+        chunk = slice(first_line, first_line + LINES_PER_GATHER)
+
+        columns[:, chunk] = lines[chunk].T
+
+      return columns
+
+  offsets = np.arange(width)
+
+  for first_line in range(0, total_lines, LINES_PER_GATHER):
+
+    chunk = slice(first_line, first_line + LINES_PER_GATHER)
+
+    positions = starts[chunk, None] + offsets
+
+    is_inside_line = offsets < lengths[chunk, None]
+
+    lines = np.full(positions.shape, SPACE, dtype=np.uint8)
+
+    lines[is_inside_line] = data[positions[is_inside_line]]
+
+    columns[:, chunk] = lines.T
+
+  return columns
+
+
+# Decode a text column such as the station ID into a fixed-width bytes array
+def decode_characters(columns, bounds):
+
+  start, end = bounds
+
+  return np.ascontiguousarray(columns[start:end].T).view(f"S{end - start}").ravel()
+
+
+'''
+  Decode an integer column for every line at once. Returns the integers and whether each line held a valid integer, following the same rules as Python's int(): surrounding spaces are allowed, a minus sign may only come before the digits and the digits may not be split by spaces.
+'''
+def decode_integers(columns, bounds):
+
+  return decode_integer_field(columns[bounds[0]:bounds[1]])
+
+
+# Like decode_integers, but for a field of any shape whose first axis holds the characters of each integer, such as the (characters x days x lines) values of the GHCNd .dly files
+def decode_integer_field(field):
+
+  shape = field.shape[1:]
+
+  values = np.zeros(shape, dtype=np.int32)
+
+  is_negative = np.zeros(shape, dtype=bool)
+
+  has_digits = np.zeros(shape, dtype=bool)
+
+  has_ended = np.zeros(shape, dtype=bool)
+
+  is_valid = np.ones(shape, dtype=bool)
+
+  # Characters below '0' wrap around to large numbers, so a single comparison finds the digits
+  digits = field - np.uint8(ZERO)
+
+  for column, column_digits in zip(field, digits):
+
+    is_digit = column_digits <= 9
+
+    is_space = column == SPACE
+
+    is_minus = column == MINUS
+
+    is_valid &= (is_digit & ~has_ended) | is_space | (is_minus & ~has_digits & ~is_negative)
+
+    values[is_digit] = values[is_digit] * 10 + column_digits[is_digit]
+
+    is_negative |= is_minus
+
+    has_ended |= is_space & has_digits
+
+    has_digits |= is_digit
+
+  return np.where(is_negative, -values, values), is_valid & has_digits
+
+
+# Turn a single line back into text, used when reporting lines that failed to parse
+def get_line(data, start, length):
+
+  return data[start:start + length].tobytes().decode('utf-8', errors='replace')
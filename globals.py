@@ -6,6 +6,7 @@
 
 import datetime
 import math
+import numpy as np
 from constants import *
 
 
@@ -54,6 +55,14 @@ def normal_round(num, decimals=0):
   return value
 
 
+# The same half-up rounding as normal_round, but applied to every value of a NumPy array or pandas Series/DataFrame at once. NaN values pass through unchanged and whole numbers stay floats so they can sit alongside NaN
+def normal_round_array(values, decimals=0):
+
+  multiplier = 10 ** decimals
+
+  return np.floor(values * multiplier + 0.5) / multiplier
+
+
   '''
   2.2.1 DATA FORMAT
 
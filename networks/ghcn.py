@@ -3,10 +3,16 @@ import pandas as pd
 import numpy as np
 import glob
 import daily
+import archives
 
 # When parsing rows for the temperature files for this network, these set the bounds for each column
 DATA_COLUMNS = [(0,11), (11, 15)] + generate_month_boundaries([5,6,7,8], 19)
 
+# The GHCNd station files, and the archive they are downloaded in
+DAILY_FOLDER = 'ghcnd_all'
+
+DAILY_ARCHIVE_FILE = 'ghcnd_all.tar.gz'
+
 
 def get_files():
 
@@ -16,17 +22,17 @@ def get_files():
 
     COUNTRIES_FILE_PATH = 'country-codes'
 
-    STATION_FILE_PATH = glob.glob(f"ghcnm.v3*/*{QUALITY_CONTROL_DATASET}.inv")[0]
+    STATION_FILE_PATH = archives.glob(f"ghcnm.v3*/*{QUALITY_CONTROL_DATASET}.inv")[0]
 
-    TEMPERATURES_FILE_PATH = glob.glob(f"ghcnm.v3*/*{QUALITY_CONTROL_DATASET}.dat")[0]
+    TEMPERATURES_FILE_PATH = archives.glob(f"ghcnm.v3*/*{QUALITY_CONTROL_DATASET}.dat")[0]
 
   elif VERSION == 'v4':
 
     COUNTRIES_FILE_PATH = 'ghcnm-countries.txt'
 
-    STATION_FILE_PATH = glob.glob(f"ghcnm.v4*/*{QUALITY_CONTROL_DATASET}.inv")[0]
+    STATION_FILE_PATH = archives.glob(f"ghcnm.v4*/*{QUALITY_CONTROL_DATASET}.inv")[0]
 
-    TEMPERATURES_FILE_PATH = glob.glob(f"ghcnm.v4*/*{QUALITY_CONTROL_DATASET}.dat")[0]
+    TEMPERATURES_FILE_PATH = archives.glob(f"ghcnm.v4*/*{QUALITY_CONTROL_DATASET}.dat")[0]
     
   elif VERSION == 'daily':
 
@@ -34,17 +40,26 @@ def get_files():
 
     STATION_FILE_PATH = 'ghcnd-stations.txt'
 
-    # Check if daily data has been compiled already
-    compiled_daily_data = glob.glob("ghcnd.tavg.*.all.dat")
+    # Get the version of the daily data
+    daily_version = daily.read_daily_version()
+
+    # Each daily dataset is a monthly series of a different element
+    daily_element = daily.ELEMENTS_BY_DATASET[QUALITY_CONTROL_DATASET]
+
+    # Check if this version of the daily data has been compiled already. Compiled files of earlier versions are updated by compile_daily_data
+    compiled_daily_data = glob.glob(daily.get_compiled_file_url(daily_version, daily_element))
 
     # If not
     if not len(compiled_daily_data):
 
-      # Get the version of the daily data
-      daily_version = open('ghcnd-version.txt', 'r').read()[37:56]
+      # Compile from the extracted daily data, or straight from its archive when archives aren't extracted (see EXTRACT_ARCHIVES). A folder left from an earlier extraction may hold an older version, so it is only used when archives are extracted
+      daily_folder = DAILY_FOLDER if EXTRACT_ARCHIVES else f"{DAILY_ARCHIVE_FILE}/{DAILY_FOLDER}"
+
+      # Compile the other elements wanted in the same pass
+      daily_elements = [ daily_element ] + [ element for element in DAILY_ELEMENTS if element != daily_element ]
 
-      # And compile the daily data into a GHCNm-like file
-      TEMPERATURES_FILE_PATH = daily.compile_daily_data(daily_version, 'ghcnd_all')
+      # And compile the daily data into GHCNm-like files
+      TEMPERATURES_FILE_PATH = daily.compile_daily_data(daily_version, daily_folder, daily_elements)[daily_element]
 
     # If the daily data has already been compiled,
     else:
@@ -95,7 +110,7 @@ def get_stations(station_file_name, country_codes_file_name):
     colspecs = [(0,2), (0,12), (12,20), (21,30), (31,37), (41,71)]
 
   stations = pd.read_fwf(
-    station_file_name, 
+    archives.open_file(station_file_name), 
     colspecs=colspecs, 
     names=names, 
     dtype=dtypes, 
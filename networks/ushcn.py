@@ -1,8 +1,8 @@
 from globals import *
 import pandas as pd
 import numpy as np
-import glob
 import os
+import archives
 
 
 # When parsing rows for the temperature files for this network, these set the bounds for each column
@@ -12,10 +12,23 @@ def compile_station_files_into_dat_file(station_files):
 
   total_stations = '{:,}'.format(len(station_files))
 
-  station_folder = station_files[0].split('/')[0]
+  station_folder = archives.get_member_name(station_files[0]).split('/')[0]
 
   OUTPUT_FILE_URL = f"{station_folder}.{QUALITY_CONTROL_DATASET}.dat"
 
+  # Station files that haven't been extracted are joined in memory when the temperatures are parsed, and only if they haven't been parsed and cached already, rather than being written to a file
+  archive = archives.split_archive_path(station_files[0])[0]
+
+  if archive is not None:
+
+    OUTPUT_FILE_URL = f"{archive}/{OUTPUT_FILE_URL}"
+
+    print(f"\n Using {total_stations} station files from '{archive}'\n")
+
+    archives.add_combined_file(OUTPUT_FILE_URL, station_files)
+
+    return OUTPUT_FILE_URL
+
   print(f"\n Compiling {total_stations} station files into '{OUTPUT_FILE_URL}'\n")
 
   if os.path.exists(OUTPUT_FILE_URL):
@@ -39,7 +52,7 @@ def get_files():
 
   STATION_FILE_PATH = 'ushcn-v2.5-stations.txt'
 
-  station_files = glob.glob(f'ushcn.v2.5*/*.{QUALITY_CONTROL_DATASET}*.tavg')
+  station_files = archives.glob(f'ushcn.v2.5*/*.{QUALITY_CONTROL_DATASET}*.tavg')
 
   TEMPERATURES_FILE_PATH = compile_station_files_into_dat_file(station_files)
 
@@ -135,6 +135,10 @@ def create_excel_file(
   average_of_grids_by_land_ratio = [],
   average_of_grids_by_land_ratio_divided = [],
 
+  average_of_grids_by_weighting = {},
+
+  grid_coverage = None,
+
   anomalies_by_grid = [],
   anomalies_by_station = [],
 
@@ -167,6 +171,17 @@ def create_excel_file(
     [ "All Grids", "" ], average_of_grids_divided
   )
 
+  # How many grid boxes, and how much of their total weight, each year's average of grids is made from
+  if grid_coverage is not None:
+
+    excel_data["Grid boxes with data"] = generate_column_for_output(
+      [ "All Grids", "" ], grid_coverage['grid_boxes']
+    )
+
+    excel_data["Total weight of grids with data"] = generate_column_for_output(
+      [ "All Grids", "" ], grid_coverage['total_weight']
+    )
+
   excel_data["Average of grids weighed with land ratio"] = generate_column_for_output(
     [ "All Grids", "" ], average_of_grids_by_land_ratio
   )
@@ -175,6 +190,17 @@ def create_excel_file(
     [ "All Grids", "" ], average_of_grids_by_land_ratio_divided
   )
 
+  # Any of the Developer's own grid weightings (see GRID_WEIGHT_TABLES in constants.py)
+  for weighting, average_of_grids_by_weighting in average_of_grids_by_weighting.items():
+
+    excel_data[f"Average of grids weighed with {weighting}"] = generate_column_for_output(
+      [ "All Grids", "" ], average_of_grids_by_weighting
+    )
+
+    excel_data[f"Average of grids weighed with {weighting} / 100"] = generate_column_for_output(
+      [ "All Grids", "" ], anomaly.divide_by_one_hundred(average_of_grids_by_weighting)
+    )
+
   if PRINT_STATION_ANOMALIES:
 
     # Print a column for each station anomaly. In GHCNm v4, using all stations, this will cause the program to crash because Excel cannot have a file with 27k columns. But it is useful for testing smaller samples.
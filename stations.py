@@ -6,9 +6,11 @@
 from globals import *
 import pandas as pd
 import numpy as np
+import math
 import os
 import download
-import glob
+import cache
+import archives
 
 from networks import ghcn
 from networks import ushcn
@@ -16,7 +18,8 @@ from networks import uscrn
 
 country_code_df = False
 
-land_mask = {}
+# The weight of every grid box, as (LATITUDE_CELLS x LONGITUDE_CELLS) arrays indexed by the latitude and longitude cell of each grid box. See read_grid_weights()
+grid_weights = {}
 
 # Arctic Circle, i.e., 66° 33′N.
 ARTIC_CIRCLE_LATITUDE = 60
@@ -28,12 +31,115 @@ https://modernsurvivalblog.com/wp-content/uploads/2013/09/united-states-latitude
 '''
 GRID_SIZE = 5
 
-def read_land_mask():
+# Number of grid boxes from pole to pole and around the earth. Each grid box is also given an integer ID of `latitude_index * LONGITUDE_CELLS + longitude_index`
+LATITUDE_CELLS = 180 // GRID_SIZE
 
-  global land_mask
+LONGITUDE_CELLS = 360 // GRID_SIZE
+
+'''
+  Calculate the weight of every grid box once and keep them as two (LATITUDE_CELLS x LONGITUDE_CELLS) arrays so the weight of a grid box is found by indexing with its grid box ID (see determine_grid_weight):
+
+    cosine_weight: the cosine of the mid-latitude of the grid box
+
+    land_weight: the cosine weight multiplied by the land percent of the grid box from the land mask, NaN where the land mask has no entry for the grid box
+
+  Like the temperature data, the weights are cached as NumPy arrays so the land mask doesn't need to be read again on later runs. They are cached for each GRID_SIZE, and cached weights for a different grid are never used.
+'''
+def read_grid_weights():
+
+  global grid_weights
+
+  if CACHE_PARSED_TEMPERATURES:
+
+    grid_weights = cache.load_grid_weights(download.LAND_MASK_FILE_NAME, GRID_SIZE)
+
+    if grid_weights and all(weights.shape == (LATITUDE_CELLS, LONGITUDE_CELLS) for weights in grid_weights.values()):
+
+      return grid_weights
+
+  # The cosine of each row of grid boxes, calculated one latitude at a time just as the weight of a single grid box would be
+  mid_latitudes = -90 + GRID_SIZE / 2 + np.arange(LATITUDE_CELLS) * GRID_SIZE
+
+  cosine_by_latitude = np.array([ np.cos( mid_latitude * (np.pi / 180) ) for mid_latitude in mid_latitudes ])
+
+  cosine_weight = np.repeat(cosine_by_latitude[:, np.newaxis], LONGITUDE_CELLS, axis=1)
 
   land_mask = pd.read_stata(download.LAND_MASK_FILE_NAME)
 
+  land_percent = arrange_by_grid_box(land_mask['gridbox'], land_mask.iloc[:, 0])
+
+  grid_weights = {
+
+    'cosine_weight': normal_round_array(cosine_weight, 4),
+
+    'land_weight': normal_round_array(cosine_weight * land_percent, 4),
+
+  }
+
+  if CACHE_PARSED_TEMPERATURES:
+
+    cache.save_grid_weights(download.LAND_MASK_FILE_NAME, GRID_SIZE, grid_weights)
+
+  return grid_weights
+
+
+# Place values labeled by grid box (e.g. "-87.5 lat -177.5 lon", like the quadrant labels) into a (LATITUDE_CELLS x LONGITUDE_CELLS) array. Grid boxes without a value are NaN
+def arrange_by_grid_box(grid_box_labels, values):
+
+  grid_box_centers = grid_box_labels.str.split(" ", expand=True)
+
+  latitude_index = get_cell_indexes(grid_box_centers[0].astype(np.float64).to_numpy(), -90, 90)
+
+  longitude_index = get_cell_indexes(grid_box_centers[2].astype(np.float64).to_numpy(), -180, 180)
+
+  is_in_grid = (latitude_index >= 0) & (longitude_index >= 0)
+
+  values_by_grid_box = np.full((LATITUDE_CELLS, LONGITUDE_CELLS), math.nan)
+
+  values_by_grid_box[ latitude_index[is_in_grid], longitude_index[is_in_grid] ] = values.astype(np.float64).to_numpy()[is_in_grid]
+
+  return values_by_grid_box
+
+
+# The weightings every run averages the grid boxes with. The Developer's own weight tables can't take these names, since the program reads its main results from these weightings
+BUILT_IN_GRID_WEIGHTINGS = [ 'cosine', 'land ratio' ]
+
+
+# Read each of the Developer's own grid box weight tables (see GRID_WEIGHT_TABLES in constants.py) into a (LATITUDE_CELLS x LONGITUDE_CELLS) array
+def read_grid_weight_tables():
+
+  grid_weight_tables = {}
+
+  for name, file_name in GRID_WEIGHT_TABLES.items():
+
+    if name in BUILT_IN_GRID_WEIGHTINGS:
+
+      raise ValueError(f"The grid weight table '{file_name}' can't be named '{name}' in GRID_WEIGHT_TABLES, since that name is used by a built-in weighting ({', '.join(BUILT_IN_GRID_WEIGHTINGS)}). Please give it another name")
+
+    grid_weight_table = pd.read_csv(file_name, dtype={ 'gridbox': str })
+
+    grid_weight_tables[name] = arrange_by_grid_box(grid_weight_table['gridbox'], grid_weight_table['weight'])
+
+  return grid_weight_tables
+
+
+# Every way the grid boxes can be weighted when averaging them together, each as a list of weights for the given grid box IDs. Besides the cosine and land ratio weights, this includes any weight tables provided by the Developer
+def get_grid_weightings(grid_ids):
+
+  grid_weightings = {
+
+    'cosine': determine_grid_weight(grid_ids),
+
+    'land ratio': determine_grid_weight(grid_ids, use_land_ratio=True),
+
+  }
+
+  for name, weights in read_grid_weight_tables().items():
+
+    grid_weightings[name] = weights.ravel()[grid_ids]
+
+  return grid_weightings
+
 
 '''
   Determine what setting/environment the station is in based on its popcls and popcss
@@ -69,7 +175,7 @@ def get_environment(row):
 
 def get_station_environment_list():
 
-  v3_station_file_name = glob.glob(f"ghcnm.v3*/*qcu.inv")[0]
+  v3_station_file_name = archives.glob(f"ghcnm.v3*/*qcu.inv")[0]
 
   dtypes = { 'station_id': str }
 
@@ -78,7 +184,7 @@ def get_station_environment_list():
   colspecs = [(0,11), (73, 74), (106,107)]
 
   stations = pd.read_fwf(
-    v3_station_file_name, 
+    archives.open_file(v3_station_file_name), 
     colspecs=colspecs, 
     names=names, 
     dtype=dtypes, 
@@ -149,7 +255,7 @@ def get_stations(station_file_name, country_codes_file_name):
 
   stations = stations.set_index('station_id')
 
-  read_land_mask()
+  read_grid_weights()
 
   stations = limit_stations_by_environment(stations, SURROUNDING_CLASS)
 
@@ -227,16 +333,41 @@ def set_station_grid_cells(stations):
 
   return stations
 
+
+# The index of the grid cell each coordinate falls into, or -1 if it falls outside. Like the loops above, a coordinate on the border of two cells belongs to the later cell
+def get_cell_indexes(coordinates, lowest, highest):
+
+  cell_starts = np.arange(lowest, highest, GRID_SIZE)
+
+  cell_indexes = np.searchsorted(cell_starts, coordinates, side='right') - 1
+
+  is_inside = (coordinates >= lowest) & (coordinates <= highest)
+
+  return np.where(is_inside, cell_indexes, -1)
+
+
+# Look up the grid box ID of each station. Integer grid box IDs let us average by grid with array operations instead of grouping on the quadrant label. Stations listed more than once use their first listing, like get_station_metadata, and stations outside of any grid box are given -1
+def get_station_grid_ids(station_ids, stations):
+
+  unique_stations = stations[~stations.index.duplicated()].reindex(station_ids)
+
+  latitude_index = get_cell_indexes(unique_stations['latitude'].to_numpy(dtype=np.float64), -90, 90)
+
+  longitude_index = get_cell_indexes(unique_stations['longitude'].to_numpy(dtype=np.float64), -180, 180)
+
+  return np.where(
+
+    (latitude_index >= 0) & (longitude_index >= 0), latitude_index * LONGITUDE_CELLS + longitude_index, -1
+
+  ).astype(np.int64)
+
 '''
 "The surface area of a grid box decreases with latitude according to the cosine of the latitude. Therefore, when calculating the regional average for a given year, the grid boxes with data [are] weighted by the cosine of the mid-latitude for that box."
 
 Connolly, Ronan & Soon, Willie & Connolly, Michael & Baliunas, Sallie & Berglund, Johan & Butler, C. & Cionco, Rodolfo & Elías, Ana & Fedorov, Valery & Harde, Hermann & Henry, Gregory & Hoyt, Douglas & Humlum, Ole & Legates, David & Luening, Sebastian & Scafetta, Nicola & Solheim, J.-E & Szarka, Laszlo & Van Loon, Harry & Zhang, Weijia. (2021). How much has the Sun influenced Northern Hemisphere temperature trends? An ongoing debate. 
 
 '''
-def determine_grid_weight(quadrant, use_land_ratio = False):
-
-  # Extract the center latitude and longitude of the cell from the quadrant
-  mid_latitude = float(quadrant.split(" ")[0])
+def determine_grid_weight(grid_ids, use_land_ratio = False):
 
   '''
   Since the grid boxes have smaller surface area closer to the earth's poles, we need to reduce the influence/weight of the smaller boxes to account for the smaller area using the mid-latitude of the grid box
@@ -246,24 +377,16 @@ def determine_grid_weight(quadrant, use_land_ratio = False):
     (Matt Rosenberg)
     ("The Distance Between Degrees of Latitude and Longitude." 24 Jan. 2020, https://www.thoughtco.com/degree-of-latitude-and-longitude-distance-4070616. Accessed 14 Mar. 2022.)
 
+  If the user wishes to reduce the weight of the grid box further by the percentage of the grid that is made of water, they may enable this in the constants.py file. Since we are only measuring land temperatures, the weight of the grid box is then reduced by the ratio of land to water.
   '''
+  if not grid_weights:
 
-  # Calculate the weight of the grid box using the cosine of the mid latitude for that box
-  grid_weight = np.cos( mid_latitude * (np.pi / 180 ) )
+    read_grid_weights()
 
-  # If the user wishes to reduce the weight of the grid box further by the percentage of the grid that is made of water, they may enable this in the constants.py file
-  if use_land_ratio:
-    # Since we are only considering land temperatures and not water, we need to determine the percent of the land that consists of land
-    matching_land_mask_row = land_mask.loc[land_mask['gridbox'] == quadrant].to_numpy()[0]
-
-    land_percent = float(matching_land_mask_row[0])
-
-    # Since we are only measuring land temperatures, we want to reduce the weight of the grid box by the ratio of land to water
-    return normal_round(grid_weight * land_percent, 4)
-
-  else:
+  weights = grid_weights['land_weight'] if use_land_ratio else grid_weights['cosine_weight']
 
-    return normal_round(grid_weight, 4)
+  # Grid box IDs number the grid boxes row by row, so they index the flattened array directly
+  return np.asarray(weights).ravel()[grid_ids]
 
 
 def capitalize_first_letters(string):
@@ -4,11 +4,16 @@
 '''
 
 from globals import *
-import pandas as pd
+import numpy as np
 import math
 import os
+import multiprocessing
 
 import anomaly
+import archives
+import cache
+import daily
+import fixed_width
 from networks import ghcn
 from networks import ushcn
 from networks import uscrn
@@ -20,6 +25,46 @@ https://www1.ncdc.noaa.gov/pub/data/ghcn/v4/readme.txt
 # Column for the first month reading
 COLUMN_FOR_FIRST_MONTH = 2
 
+'''
+  Each monthly reading is followed by three flags (DMFLAG, QCFLAG, DSFLAG). Rather than keeping all three characters, the parser packs them into the bits of a single byte per month so any flag policy can be applied later without parsing the file again.
+
+    DMFLAG: data measurement flag, 'E' for estimated and 'a'-'i' for the number of days missing from the month (GHCNm v4)
+
+    QCFLAG: quality control flag, blank if the reading passed every quality control check
+
+    DSFLAG: data source flag, blank if no source is given
+'''
+FLAG_ESTIMATED = 1
+
+FLAG_DAYS_MISSING = 2
+
+FLAG_OTHER_MEASUREMENT = 4
+
+FLAG_QUALITY_CONTROL = 8
+
+FLAG_DATA_SOURCE = 16
+
+# Which flags cause a reading to be rejected, depending on whether the Developer has chosen to PURGE_FLAGS
+FLAG_POLICIES = {
+
+  False: 0,
+
+  True: FLAG_ESTIMATED | FLAG_QUALITY_CONTROL,
+
+}
+
+# Stations are processed this many at a time (see get_station_records), which keeps memory use small even with the 27k stations of GHCNm v4
+STATIONS_PER_BLOCK = 1024
+
+# Temperature files are decoded this many bytes at a time (see parse_temperature_file_range)
+READ_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Files smaller than this many bytes per worker process are parsed by fewer processes (see INGEST_WORKERS in constants.py), since starting a process takes longer than parsing a small file
+MINIMUM_BYTES_PER_WORKER = 8 * 1024 * 1024
+
+# Keeps each parsed file in memory so results can be compared across flag policies without reading it again
+parsed_files = {}
+
 
 data_format_by_network = {
   
@@ -31,131 +76,400 @@ data_format_by_network = {
 
 }
 
+# Pack the three flag characters of each reading into the bits of one byte
+def pack_flags(DMFLAGS, QCFLAGS, DSFLAGS):
+
+  is_estimated = DMFLAGS == ord('E')
+
+  is_missing_days = (DMFLAGS >= ord('a')) & (DMFLAGS <= ord('i'))
+
+  is_other_measurement = (DMFLAGS != ord(' ')) & ~is_estimated & ~is_missing_days
+
+  return (
+
+    is_estimated * FLAG_ESTIMATED |
+
+    is_missing_days * FLAG_DAYS_MISSING |
+
+    is_other_measurement * FLAG_OTHER_MEASUREMENT |
+
+    (QCFLAGS != ord(' ')) * FLAG_QUALITY_CONTROL |
+
+    (DSFLAGS != ord(' ')) * FLAG_DATA_SOURCE
+
+  ).astype(np.uint8)
+
+
 '''
- Returns the temperature reading if the flags are approved, otherwise you may return NaN
+ Returns the temperature readings whose flags are approved, with missing and rejected readings set to the MISSING_VALUE. Readings stay whole numbers in hundredths of a degree until they are averaged. Each argument holds one column per month for every parsed row.
    
-   VALUE: monthly value (MISSING=-9999).  Temperature values are in hundredths of a degree Celsius, but are expressed as whole integers (e.g. divide by 100.0 to get whole degrees Celsius).
+   VALUES: monthly values (MISSING=-9999).  Temperature values are in hundredths of a degree Celsius, but are expressed as whole integers (e.g. divide by 100.0 to get whole degrees Celsius).
 
-   DMFLAG: data measurement flag
-   
-   QCFLAG: quality control flag
-   
-   DSFLAG: data source flag
+   FLAGS: the packed flags of each reading (see pack_flags)
+
+   REJECTED_FLAGS: any reading with one of these flags is set as missing
 '''
-def get_permitted_reading(VALUE, DMFLAG, QCFLAG, DSFLAG):
+def get_permitted_readings(VALUES, FLAGS, REJECTED_FLAGS = FLAG_POLICIES[PURGE_FLAGS]):
+
+  is_permitted = (VALUES != MISSING_VALUE) & ((FLAGS & REJECTED_FLAGS) == 0)
+
+  return np.where(is_permitted, VALUES, MISSING_VALUE).astype(np.int16)
 
-  # If the Developer has chosen to PURGE_Flags, we set as missing as readings that have an Estimated or Quality Control Flag
-  return VALUE if not PURGE_FLAGS or (not DMFLAG == 'E' and QCFLAG == ' ') else math.nan
 
+# Convert readings in hundredths of a degree to floats for calculations, with missing readings as NaN
+def to_float_readings(readings):
 
-def parse_temperature_row(
+  return np.where(readings == MISSING_VALUE, math.nan, readings)
 
-  unparsed_row, 
 
-  column_boundries = [(0,11), (11, 15)], 
+'''
+  Decode the lines of a temperature file held in `data` for all lines at once using the column boundaries of the network (see DATA_COLUMNS in the networks folder). Returns the station IDs, years, raw monthly values and the packed flags of each month as NumPy arrays, along with any lines that could not be parsed.
 
-  column_types = ([str, int] + ([int, str, str, str] * 12))
+  If a list of `station_ids` is given, only the station ID at the start of each line is read at first, and lines of any other station are skipped before the rest of the line is decoded.
+'''
+def parse_temperature_lines(data, column_boundaries, station_ids = None):
 
-):
+  starts, lengths = fixed_width.find_lines(data)
 
-  try:
+  if station_ids is not None:
 
-    parsed_row = []
+    station_id_bounds = column_boundaries[0]
 
-    for column_index, bounds in enumerate(column_boundries):
+    station_id_of_line = fixed_width.decode_characters(fixed_width.to_columns(data, starts, lengths, station_id_bounds[1]), station_id_bounds)
 
-      column_value = unparsed_row[bounds[0]:bounds[1]]
+    is_requested = np.isin(station_id_of_line, np.asarray(station_ids).astype(station_id_of_line.dtype))
 
-      column_value_as_type = column_types[column_index](column_value)
+    starts, lengths = starts[is_requested], lengths[is_requested]
 
-      parsed_row.append(column_value_as_type)
+  line_width = max(end for start, end in column_boundaries)
 
-    return parsed_row
+  columns = fixed_width.to_columns(data, starts, lengths, line_width)
 
-  except:
+  station_ids = fixed_width.decode_characters(columns, column_boundaries[0])
 
-    print('Error parsing row', unparsed_row)
+  years, is_valid = fixed_width.decode_integers(columns, column_boundaries[1])
 
-    return False
+  total_rows = len(starts)
 
+  values = np.empty((total_rows, 12), dtype=np.int16)
 
-def get_station_start_and_end_year(temperature_data_for_station):
+  flags = np.empty((total_rows, 12), dtype=np.uint8)
 
-  start_year = temperature_data_for_station.index[0]
+  # Each month has 4 columns, the value and its three flags
+  for month in range(12):
 
-  end_year = temperature_data_for_station.index[-1]
-  
-  return start_year, end_year
+    value_bounds, *flag_bounds = column_boundaries[ COLUMN_FOR_FIRST_MONTH + month * 4 : COLUMN_FOR_FIRST_MONTH + month * 4 + 4 ]
+
+    month_values, is_valid_value = fixed_width.decode_integers(columns, value_bounds)
+
+    # Values are kept as 16-bit integers, so a value too large to fit, like a corrupt field, makes the line invalid rather than wrapping around to a different reading
+    is_valid &= is_valid_value & (month_values >= np.iinfo(np.int16).min) & (month_values <= np.iinfo(np.int16).max)
+
+    values[:, month] = month_values
+
+    flags[:, month] = pack_flags(*[ columns[bounds[0]] for bounds in flag_bounds ])
+
+  invalid_lines = [ fixed_width.get_line(data, starts[invalid_row], lengths[invalid_row]) for invalid_row in np.flatnonzero(~is_valid) ]
+
+  parsed_lines = {
+
+    'station_id': station_ids[is_valid],
+
+    'year': years[is_valid],
+
+    'values': values[is_valid],
+
+    'flags': flags[is_valid],
+
+  }
+
+  return parsed_lines, invalid_lines
+
+
+'''
+  Parse the lines of the temperature file between the bytes `start` and `end`. Each worker process of parse_temperature_file reads and parses its own range of the file.
+
+  Rather than reading the whole range into memory, the file is memory-mapped and decoded READ_CHUNK_BYTES at a time. The lines are counted first, so the decoded values of each chunk can be written straight into arrays made at their final size. That keeps the memory used close to the size of the decoded values rather than several times the size of the text.
+'''
+def parse_temperature_file_range(url, start, end, column_boundaries, station_ids = None):
+
+  return parse_temperature_data_range(fixed_width.map_file(url), start, end, column_boundaries, station_ids)
+
+
+# Parse the lines of `data`, the bytes of a temperature file, between the bytes `start` and `end` (see parse_temperature_file_range)
+def parse_temperature_data_range(data, start, end, column_boundaries, station_ids = None):
+
+  chunks = fixed_width.split_into_line_chunks(data, start, end, READ_CHUNK_BYTES)
+
+  total_lines = sum(fixed_width.count_lines(data[chunk_start:chunk_end]) for chunk_start, chunk_end in chunks)
+
+  station_id_bounds = column_boundaries[0]
+
+  parsed_range = {
+
+    'station_id': np.empty(total_lines, dtype=f"S{station_id_bounds[1] - station_id_bounds[0]}"),
+
+    'year': np.empty(total_lines, dtype=np.int32),
+
+    'values': np.empty((total_lines, 12), dtype=np.int16),
+
+    'flags': np.empty((total_lines, 12), dtype=np.uint8),
+
+  }
+
+  total_parsed = 0
+
+  invalid_lines = []
+
+  for chunk_start, chunk_end in chunks:
+
+    parsed_lines, invalid_lines_of_chunk = parse_temperature_lines(np.asarray(data[chunk_start:chunk_end]), column_boundaries, station_ids)
+
+    lines_in_chunk = len(parsed_lines['year'])
+
+    for name, array in parsed_range.items():
+
+      array[ total_parsed : total_parsed + lines_in_chunk ] = parsed_lines[name]
+
+    total_parsed += lines_in_chunk
+
+    invalid_lines += invalid_lines_of_chunk
+
+  # Blank, invalid and skipped lines leave room at the end of the arrays
+  return { name: array[:total_parsed] for name, array in parsed_range.items() }, invalid_lines
+
+
+'''
+  Decode a temperature file (see parse_temperature_lines). With INGEST_WORKERS above 1, large files are split into ranges of whole lines that are parsed at the same time by separate processes and joined back together in the order of the file.
+
+  Separate processes are started by forking this one, so the program doesn't start over in each of them. Where forking isn't available (Windows), the file is parsed in this process alone.
 
+  The station ID of each row is replaced by a `station_code` pointing into a sorted table of `station_ids`.
+'''
+def parse_temperature_file(url, column_boundaries, station_ids = None):
+
+  line_ranges = [] if archives.is_in_archive(url) else fixed_width.split_into_line_ranges(url, INGEST_WORKERS, MINIMUM_BYTES_PER_WORKER)
+
+  # A file within an archive is decompressed into memory once and parsed in this process
+  if archives.is_in_archive(url):
+
+    data = np.frombuffer(archives.read_file(url), dtype=np.uint8)
+
+    parsed_ranges = [ parse_temperature_data_range(data, 0, len(data), column_boundaries, station_ids) ]
+
+  elif len(line_ranges) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+
+    with multiprocessing.get_context('fork').Pool(len(line_ranges)) as pool:
+
+      parsed_ranges = pool.starmap(parse_temperature_file_range, [ (url, start, end, column_boundaries, station_ids) for start, end in line_ranges ])
+
+  else:
+
+    parsed_ranges = [ parse_temperature_file_range(url, 0, os.path.getsize(url), column_boundaries, station_ids) ]
+
+  for parsed_lines, invalid_lines in parsed_ranges:
+
+    for invalid_line in invalid_lines:
+
+      print('Error parsing row', invalid_line)
+
+  if len(parsed_ranges) == 1:
+
+    parsed_file = parsed_ranges[0][0]
+
+  else:
+
+    parsed_file = {
+
+      name: np.concatenate([ parsed_lines[name] for parsed_lines, invalid_lines in parsed_ranges ]) for name in parsed_ranges[0][0]
+
+    }
+
+  # Rather than keeping the 11 character ID of the station on every row, each station ID is kept once in a sorted table and every row holds the position of its station in that table
+  station_ids, station_codes = np.unique(parsed_file.pop('station_id'), return_inverse=True)
+
+  return {
+
+    'station_ids': station_ids,
+
+    'station_code': station_codes.astype(np.int32),
+
+    **parsed_file,
+
+  }
+
+
+'''
+  Parse the temperature file, or load it from the cache of a previous run if the file has not changed since.
+
+  When only some stations are used (`station_ids`) and the parsed file isn't being cached (see CACHE_PARSED_TEMPERATURES), only the lines of those stations are parsed. When it is cached, the whole file is parsed once so later runs with any stations can load it, and the stations are filtered afterwards.
+'''
+def read_temperature_file(url, station_ids = None):
+
+  if url in parsed_files:
+
+    return parsed_files[url]
+
+  # Daily data compiled into binary arrays is loaded as it is, with no text to parse
+  if url.endswith(daily.COMPILED_EXTENSIONS['binary']):
+
+    parsed_files[url] = daily.load_compiled_daily_data(url)
+
+    return parsed_files[url]
+
+  if CACHE_PARSED_TEMPERATURES:
+
+    parsed_file = cache.load_parsed_file(url)
+
+    if parsed_file:
+
+      parsed_files[url] = parsed_file
+
+      return parsed_file
+
+  if station_ids is not None and not CACHE_PARSED_TEMPERATURES:
 
-# Check if the station has enough data during the baseline years to be used
-def has_enough_years(station, minimum_years_needed):
+    return parse_temperature_file(url, data_format_by_network[NETWORK], station_ids)
 
-  rows_of_reference_years = station.loc[(station.name, REFERENCE_START_YEAR):(station.name, REFERENCE_END_YEAR)]
+  parsed_file = parse_temperature_file(url, data_format_by_network[NETWORK])
 
-  return len(rows_of_reference_years) >= minimum_years_needed
+  if CACHE_PARSED_TEMPERATURES:
 
+    cache.save_parsed_file(url, parsed_file)
 
-def approve_and_simplify_row(parsed_row):
+  parsed_files[url] = parsed_file
 
-  simplified_row = parsed_row[ 0 : COLUMN_FOR_FIRST_MONTH ]
+  return parsed_file
 
-  # Loop through all 12 months in the parsed row, 4 columns at a time (for the value and its flags)
-  for month_column in range(0, 12 * 4, 4):
 
-    current_column = COLUMN_FOR_FIRST_MONTH + month_column
+'''
+  Sort the rows of the temperature data by station and summarize each station with its ID, the first and last year of its data and where its rows begin. Stations are sorted by ID.
+'''
+def arrange_by_station(station_temperatures):
+
+  station_codes, station_indexes = np.unique(station_temperatures['station_code'], return_inverse=True)
+
+  # A stable sort keeps each station's rows in the same order as the file
+  row_order = np.argsort(station_indexes, kind='stable')
+
+  row_counts = np.bincount(station_indexes, minlength=len(station_codes))
+
+  first_rows = np.cumsum(row_counts) - row_counts
+
+  years = station_temperatures['year'][row_order]
+
+  return {
+
+    'station_id': station_temperatures['station_ids'][station_codes].astype(str),
+
+    'start_year': years[first_rows],
+
+    'end_year': years[first_rows + row_counts - 1],
 
-    VALUE, DMFLAG, QCFLAG, DSFLAG = parsed_row[ current_column : current_column + 4 ]
+    'first_row': first_rows,
 
-    # Convert the reading to an integer if its not already. Convert missing values to NaN
-    VALUE = int(VALUE) if not math.isnan(VALUE) and VALUE != MISSING_VALUE else math.nan
+    'row_count': row_counts,
 
-    # Get approval for each reading based on its flags
-    permitted_temperature = get_permitted_reading(VALUE, DMFLAG, QCFLAG, DSFLAG)
+    'year': years,
+
+    'readings': station_temperatures['values'][row_order],
+
+  }
+
+
+'''
+  Returns the rows of stations `first_station` up to `last_station` that fall within the YEAR_RANGE. Rather than giving every station a row for every year of the YEAR_RANGE, only the years each station has data for are kept:
+
+    station_index: which of the stations each row belongs to, counting from `first_station`
+
+    year: the year of each row
+
+    temperatures: the 12 monthly readings of each row as floats, with missing readings as NaN
+
+    total_stations: the number of stations
+'''
+def get_station_records(stations_data, first_station, last_station):
 
-    # Only include the approved temperature in the simplified row, leaving out the flags
-    simplified_row = simplified_row + [ permitted_temperature ]
+  row_counts = stations_data['row_count'][first_station:last_station]
 
-  return simplified_row
+  rows = slice(stations_data['first_row'][first_station], stations_data['first_row'][first_station] + row_counts.sum())
 
+  station_indexes = np.repeat(np.arange(len(row_counts)), row_counts)
 
-def get_temperatures_by_station(url, STATIONS):
+  years = stations_data['year'][rows]
 
-  # Read the station's temperature file, each row will be a plain string and will not be parsed or separated already into a dataframe. Although this is inconvenient to manually parse each row before converting into a dataframe, it massively improves performance.
-  unparsed_station_data = pd.read_csv(url, sep="\t", header=None, low_memory=False)
+  is_in_year_range = (years >= YEAR_RANGE_START) & (years < YEAR_RANGE_END)
 
-  parsed_rows = []
+  return {
 
-  for unparsed_row_string in unparsed_station_data.values:
+    'station_index': station_indexes[is_in_year_range],
 
-    parsed_row = parse_temperature_row(unparsed_row_string[0], data_format_by_network[NETWORK])
+    'year': years[is_in_year_range],
 
-    if parsed_row:
+    'temperatures': to_float_readings(stations_data['readings'][rows][is_in_year_range]),
 
-      simplified_row = approve_and_simplify_row(parsed_row)
+    'total_stations': len(row_counts),
 
-      parsed_rows.append(simplified_row)
+  }
 
-  station_temperatures = pd.DataFrame(parsed_rows, columns=['station_id',  'year'] + MONTH_COLUMNS)
+
+# Check which stations have enough years of data during the baseline years to be used. Returns whether each station of the `station_ids` table has enough years
+def has_enough_years(station_codes, years, total_stations, minimum_years_needed):
+
+  is_reference_year = (years >= REFERENCE_START_YEAR) & (years <= REFERENCE_END_YEAR)
+
+  return np.bincount(station_codes[is_reference_year], minlength=total_stations) >= minimum_years_needed
+
+
+'''
+  Returns the temperature data of the approved stations that have enough data. Rather than a table, the data is kept as compact arrays:
+
+    station_ids: a sorted table of the station IDs
+
+    station_code: the position of each row's station in `station_ids`
+
+    year: the year of each row
+
+    values: the 12 monthly readings of each row in hundredths of a degree, with missing and rejected readings set to the MISSING_VALUE
+
+  Set `purge_flags` to compare results with and without flagged readings from the same parsed file.
+'''
+def get_temperatures_by_station(url, STATIONS, purge_flags = PURGE_FLAGS):
 
   # Stations may be filtered by environment or country, therefore we only use temperature data from approved stations
-  if SURROUNDING_CLASS or IN_COUNTRY:
+  approved_station_ids = STATIONS.index.to_numpy() if SURROUNDING_CLASS or IN_COUNTRY else None
+
+  parsed_file = read_temperature_file(url, approved_station_ids)
+
+  station_ids, station_codes, years = parsed_file['station_ids'], parsed_file['station_code'], parsed_file['year']
+
+  values = get_permitted_readings(parsed_file['values'], parsed_file['flags'], FLAG_POLICIES[purge_flags])
 
-    station_temperatures = station_temperatures[station_temperatures['station_id'].isin(STATIONS.index)]
+  is_kept = np.ones(len(years), dtype=bool)
 
-  station_temperatures.set_index([ 'station_id', 'year'], inplace=True)
+  # The whole file may have been loaded from the cache, in which case the other stations still need to be removed
+  if approved_station_ids is not None:
 
-  # Drop rows with too many null months
-  station_temperatures.dropna(thresh=MONTHS_REQUIRED_EACH_YEAR, subset=MONTH_COLUMNS, inplace=True)
+    is_kept &= np.isin(station_ids, approved_station_ids.astype(station_ids.dtype))[station_codes]
+
+  # Drop rows with too many missing months
+  is_kept &= (values != MISSING_VALUE).sum(axis=1) >= MONTHS_REQUIRED_EACH_YEAR
 
   # Drop stations with not enough years in the baseline range
   minimum_years_needed = anomaly.get_minimum_years(REFERENCE_RANGE)
 
-  station_temperatures = station_temperatures.groupby('station_id').filter(
+  is_kept &= has_enough_years(station_codes[is_kept], years[is_kept], len(station_ids), minimum_years_needed)[station_codes]
+
+  kept_rows = np.flatnonzero(is_kept)
+
+  return {
+
+    'station_ids': station_ids,
+
+    'station_code': station_codes[kept_rows],
 
-    lambda station: has_enough_years(station, minimum_years_needed)
-    
-  )
+    'year': years[kept_rows],
 
-  return station_temperatures.reset_index().set_index('year').groupby('station_id')
+    'values': values[kept_rows],
 
+  }